@@ -0,0 +1,153 @@
+"""
+Minecraft 狀態查詢與 RCON 的壓測，對象為 bench/mcstub.py 啟動的本機替身伺服器
+
+直接呼叫 src/routers/minecraft.py 的處理函式 (略過 HTTP 與 RateLimiter)，
+輸出每個情境的吞吐量與 p50 / p99 延遲。在專案根目錄執行：
+
+    python -m bench.bench_minecraft --requests 2000 --concurrency 64 --latency 0.01
+    python -m bench.bench_minecraft --scenarios rcon rcon-fresh rcon-batch --failure-rate 0.05
+"""
+import argparse, asyncio, logging, os, sys, time
+
+from bench.mcstub import MinecraftStub, build_parser as build_stub_parser, config_from_args
+
+SCENARIOS = ["java", "java-mcstatus", "java-mcclient", "bedrock", "bulk", "rcon", "rcon-fresh", "rcon-batch"]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark Minecraft status and RCON handlers against a local stub server.",
+                                     parents=[build_stub_parser()], conflict_handler="resolve")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent requests")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--batch-size", type=int, default=20, help="Commands per RCON batch / targets per bulk request")
+    parser.add_argument("--cache", action="store_true", help="Keep the status cache and request coalescing (bypassed by default so every request probes)")
+    parser.add_argument("--breaker", action="store_true", help="Keep the circuit breaker enabled (disabled by default)")
+    return parser
+
+
+class UncachedStatus:
+    """取代 mcprobe.status_cache：不快取也不合併同時的查詢，每個請求都實際探測一次"""
+
+    async def get_or_fetch(self, key, factory, ttl_of=None):
+        return await factory(), False, 0.0
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_scenario(name: str, call, requests: int, concurrency: int) -> dict:
+    """以固定的並行數執行 call()，call 回傳是否成功"""
+    latencies = []
+    failures = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal failures
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                ok = await call()
+            except Exception as e:
+                logging.debug(f"{name}: {e!r}")
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "requests": requests,
+        "failures": failures,
+        "throughput": requests / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+def build_scenarios(args, stub: MinecraftStub) -> dict:
+    # 需在設定環境變數後才匯入，模組載入時就會讀取設定
+    from src.routers import minecraft
+    from src.utils import mcprobe
+    import aiomcrcon
+
+    if not args.cache:
+        # TTL 設為 0 仍會合併同一目標的同時查詢，所有情境都打同一個替身伺服器，需完全略過快取
+        mcprobe.status_cache = UncachedStatus()
+
+    host, password = stub.host, stub.config.rcon_password
+
+    def status_call(handler, port):
+        async def call():
+            return (await handler(host=host, port=port)).status_code == 200
+        return call
+
+    async def bulk():
+        request = minecraft.MinecraftBulkStatusRequest(targets=[
+            {"edition": "java" if i % 2 else "bedrock", "host": host, "port": stub.java_port if i % 2 else stub.bedrock_port}
+            for i in range(args.batch_size)
+        ])
+        response = await minecraft.minecraft_status_bulk(request)
+        async for _ in response.body_iterator:
+            pass
+        return True
+
+    async def rcon():
+        request = minecraft.MinecraftRconRequest(host=host, port=stub.rcon_port, password=password, cmd="list")
+        return (await minecraft.minecraft_rcon(request)).status_code == 200
+
+    async def rcon_fresh():
+        # 對照組：每個指令都重新連線與驗證，即連線池導入前的做法
+        client = aiomcrcon.Client(host=host, port=stub.rcon_port, password=password)
+        try:
+            await client.connect()
+            await client.send_cmd("list")
+            return True
+        finally:
+            await client.close()
+
+    async def rcon_batch():
+        request = minecraft.MinecraftRconBatchRequest(host=host, port=stub.rcon_port, password=password,
+                                                      cmds=[f"say {i}" for i in range(args.batch_size)])
+        return (await minecraft.minecraft_rcon_batch(request)).status_code == 200
+
+    return {
+        "java": status_call(minecraft.minecraft_status_java, stub.java_port),
+        "java-mcstatus": status_call(minecraft.minecraft_status_java_mcstatus, stub.java_port),
+        "java-mcclient": status_call(minecraft.minecraft_status_java_mcclient, stub.java_port),
+        "bedrock": status_call(minecraft.minecraft_status_bedrock, stub.bedrock_port),
+        "bulk": bulk,
+        "rcon": rcon,
+        "rcon-fresh": rcon_fresh,
+        "rcon-batch": rcon_batch,
+    }
+
+
+async def main(args):
+    stub = await MinecraftStub(config_from_args(args)).start()
+    from src.utils.rconpool import rcon_pool
+    try:
+        scenarios = build_scenarios(args, stub)
+        print(f"{'scenario':<15}{'requests':>10}{'failures':>10}{'req/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+        for name in args.scenarios:
+            result = await run_scenario(name, scenarios[name], args.requests, args.concurrency)
+            print(f"{result['scenario']:<15}{result['requests']:>10}{result['failures']:>10}"
+                  f"{result['throughput']:>12.1f}{result['p50']:>10.2f}{result['p99']:>10.2f}")
+    finally:
+        await rcon_pool.close_all()
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if not args.breaker:
+        os.environ["MC_BREAKER_THRESHOLD"] = str(sys.maxsize)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s:%(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    asyncio.run(main(args))
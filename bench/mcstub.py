@@ -0,0 +1,232 @@
+"""
+本機 Minecraft 協定替身伺服器，用於測試與壓測 src/routers/minecraft.py
+
+支援 Java SLP (TCP)、Query (UDP，與 SLP 同埠)、Bedrock unconnected ping (UDP) 與 RCON (TCP)，
+可設定回應延遲、失敗機率與伺服器圖示大小。
+
+    python -m bench.mcstub --latency 0.02 --failure-rate 0.1 --favicon-size 12000
+"""
+import argparse, asyncio, base64, json, logging, os, random, struct
+
+BEDROCK_MAGIC = bytes.fromhex("00ffff00fefefefefdfdfdfd12345678")
+
+
+class StubConfig:
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, favicon_size: int = 8192,
+                 players: int = 12, max_players: int = 100, rcon_password: str = "password"):
+        self.latency = latency            # 每個回應前等待的秒數
+        self.failure_rate = failure_rate  # 直接斷線 / 不回應的機率
+        self.favicon_size = favicon_size  # 伺服器圖示的位元組數 (0 表示不提供)
+        self.players = players
+        self.max_players = max_players
+        self.rcon_password = rcon_password
+
+    def should_fail(self) -> bool:
+        return random.random() < self.failure_rate
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    value &= 0xFFFFFFFF
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+async def _read_varint(reader: asyncio.StreamReader) -> int:
+    result = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result
+    raise ValueError("VarInt too long")
+
+
+def _packet(packet_id: int, payload: bytes) -> bytes:
+    body = _varint(packet_id) + payload
+    return _varint(len(body)) + body
+
+
+class MinecraftStub:
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1"):
+        self.config = config
+        self.host = host
+        self.java_port = None
+        self.bedrock_port = None
+        self.rcon_port = None
+        self._servers = []
+        self._transports = []
+        favicon = os.urandom(config.favicon_size) if config.favicon_size else b""
+        self.status_json = json.dumps({
+            "version": {"name": "Stub 1.20.4", "protocol": 765},
+            "players": {
+                "max": config.max_players,
+                "online": config.players,
+                "sample": [{"name": f"player{i}", "id": f"00000000-0000-0000-0000-{i:012d}"} for i in range(min(config.players, 12))],
+            },
+            "description": {"text": "Minecraft protocol stub"},
+            **({"favicon": "data:image/png;base64," + base64.b64encode(favicon).decode()} if favicon else {}),
+        }).encode()
+
+    async def _delay(self):
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+
+    # Java Server List Ping
+    async def _handle_slp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                length = await _read_varint(reader)
+                data = await reader.readexactly(length)
+                packet_id = data[0]
+                if self.config.should_fail():
+                    return
+                await self._delay()
+                if packet_id == 0x00 and len(data) == 1:
+                    # Status Request (Handshake 封包也是 0x00 但帶有內容，不需回應)
+                    writer.write(_packet(0x00, _varint(len(self.status_json)) + self.status_json))
+                elif packet_id == 0x01:
+                    writer.write(_packet(0x01, data[1:9]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # RCON
+    async def _handle_rcon(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        authenticated = False
+        try:
+            while True:
+                length = struct.unpack("<i", await reader.readexactly(4))[0]
+                data = await reader.readexactly(length)
+                request_id, packet_type = struct.unpack("<ii", data[:8])
+                body = data[8:-2].decode("utf-8", errors="replace")
+                if self.config.should_fail():
+                    return
+                await self._delay()
+                if packet_type == 3:
+                    authenticated = body == self.config.rcon_password
+                    response_id, response_type, response = (request_id if authenticated else -1), 2, ""
+                elif packet_type == 2 and authenticated:
+                    response_id, response_type, response = request_id, 0, f"Executed: {body}"
+                else:
+                    response_id, response_type, response = -1, 0, ""
+                payload = struct.pack("<ii", response_id, response_type) + response.encode() + b"\x00\x00"
+                writer.write(struct.pack("<i", len(payload)) + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error):
+            pass
+        finally:
+            writer.close()
+
+    def _query_response(self, data: bytes):
+        # Query: FE FD | 類型 | session id | ...
+        if len(data) < 7 or data[:2] != b"\xfe\xfd":
+            return None
+        packet_type, session = data[2], data[3:7]
+        if packet_type == 9:
+            return b"\x09" + session + b"9513307\x00"
+        if packet_type == 0:
+            kv = {
+                "hostname": "Minecraft protocol stub", "gametype": "SMP", "game_id": "MINECRAFT",
+                "version": "1.20.4", "plugins": "Paper on 1.20.4: StubPlugin 1.0; OtherPlugin 2.1", "map": "world",
+                "numplayers": str(self.config.players), "maxplayers": str(self.config.max_players),
+                "hostport": str(self.java_port), "hostip": self.host,
+            }
+            body = b"".join(k.encode() + b"\x00" + v.encode() + b"\x00" for k, v in kv.items()) + b"\x00"
+            players = b"".join(f"player{i}".encode() + b"\x00" for i in range(self.config.players)) + b"\x00"
+            return b"\x00" + session + b"splitnum\x00\x80\x00" + body + b"\x01player_\x00\x00" + players
+        return None
+
+    def _bedrock_response(self, data: bytes):
+        # Unconnected Ping: 0x01 | time (8) | magic (16) | client guid (8)
+        if len(data) < 25 or data[0] != 0x01:
+            return None
+        server_guid = 0x1234567890ABCDEF
+        motd = f"MCPE;Minecraft protocol stub;622;1.20.40;{self.config.players};{self.config.max_players};{server_guid};Stub;Survival;1;{self.bedrock_port};{self.bedrock_port};"
+        return b"\x1c" + data[1:9] + struct.pack(">Q", server_guid) + BEDROCK_MAGIC + struct.pack(">H", len(motd)) + motd.encode()
+
+    def _udp_protocol(self, responder):
+        stub = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                if stub.config.should_fail():
+                    return
+                response = responder(data)
+                if response is not None:
+                    asyncio.get_running_loop().call_later(stub.config.latency, self.transport.sendto, response, addr)
+
+        return Protocol
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # Query 與 SLP 使用同一個埠號，先拿到 TCP 埠再綁定相同的 UDP 埠
+        for _ in range(20):
+            slp = await asyncio.start_server(self._handle_slp, self.host, 0)
+            self.java_port = slp.sockets[0].getsockname()[1]
+            try:
+                transport, _ = await loop.create_datagram_endpoint(self._udp_protocol(self._query_response), local_addr=(self.host, self.java_port))
+                break
+            except OSError:
+                slp.close()
+        else:
+            raise RuntimeError("Unable to bind SLP and Query to the same port")
+        self._servers.append(slp)
+        self._transports.append(transport)
+
+        transport, _ = await loop.create_datagram_endpoint(self._udp_protocol(self._bedrock_response), local_addr=(self.host, 0))
+        self.bedrock_port = transport.get_extra_info("socket").getsockname()[1]
+        self._transports.append(transport)
+
+        rcon = await asyncio.start_server(self._handle_rcon, self.host, 0)
+        self.rcon_port = rcon.sockets[0].getsockname()[1]
+        self._servers.append(rcon)
+        return self
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for transport in self._transports:
+            transport.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Local Minecraft protocol stub server.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability of dropping a request")
+    parser.add_argument("--favicon-size", type=int, default=8192, help="Favicon size in bytes, 0 to disable")
+    parser.add_argument("--rcon-password", default="password")
+    return parser
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(latency=args.latency, failure_rate=args.failure_rate, favicon_size=args.favicon_size, rcon_password=args.rcon_password)
+
+
+async def _serve(args):
+    stub = await MinecraftStub(config_from_args(args)).start()
+    logging.info(f"Java SLP/Query on {stub.host}:{stub.java_port}, Bedrock on {stub.bedrock_port}/udp, RCON on {stub.rcon_port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s:%(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    try:
+        asyncio.run(_serve(build_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,68 @@
+import argparse, json, logging, sys
+from datetime import datetime
+from dotenv import load_dotenv
+from src.core.log import ColorizingStreamHandler
+
+# 配置 logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s:%(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    handlers=[
+        ColorizingStreamHandler(),  # 使用自定義的顏色處理器
+    ],
+)
+
+load_dotenv()
+
+from src.utils.sensorstore import ImportConflictError, create_sensor_db, import_readings, rebuild_rollups
+
+
+def parse_entries(entries: list) -> list:
+    # db.json 的 time 為本地時間字串 "%Y-%m-%d %H:%M:%S"
+    return [
+        (
+            entry["id"],
+            int(datetime.strptime(entry["time"], "%Y-%m-%d %H:%M:%S").timestamp()),
+            entry["temperature"],
+            entry["humidity"],
+        )
+        for entry in entries
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import sensor readings from a legacy db.json into the sensor store.")
+    parser.add_argument("source", nargs="?", default="db.json", help="Path to db.json")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be imported")
+    args = parser.parse_args()
+
+    with open(args.source, "r", encoding="utf-8") as file:
+        db_data = json.load(file)
+
+    if not args.dry_run:
+        create_sensor_db()
+    total = 0
+    failed = 0
+    for sensor, entries in db_data.items():
+        rows = parse_entries(entries)
+        # 重複執行時已匯入的 id 會略過；id 已被 API 寫入的新資料使用時該感測器整批不匯入
+        try:
+            inserted = len(rows) if args.dry_run else import_readings(sensor, rows)
+        except ImportConflictError as e:
+            logging.error(f"{e}. Nothing was imported for this sensor; import db.json before the API accepts new readings.")
+            failed += 1
+            continue
+        if inserted and not args.dry_run:
+            rebuild_rollups(sensor)
+        logging.info(f"{sensor}: {inserted}/{len(rows)} readings imported")
+        total += inserted
+    logging.info(f"Import finished: {total} readings from {len(db_data)} sensors")
+    if failed:
+        logging.error(f"{failed} sensors were not imported because of id conflicts.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
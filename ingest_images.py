@@ -0,0 +1,181 @@
+import argparse, csv, hashlib, json, logging, os, sys, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from src.core.log import ColorizingStreamHandler
+
+# 配置 logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s:%(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    handlers=[
+        ColorizingStreamHandler(),  # 使用自定義的顏色處理器
+    ],
+)
+
+load_dotenv()
+
+import pymysql.cursors
+from src.database.mariadb import pool
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif"}
+BATCH_SIZE = 1000           # 每個交易寫入的筆數
+SIZE_UNIT = 1024 * 1024     # size 欄位以 MB 儲存
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def scan_directory(root: str) -> list:
+    # fileName 為相對於根目錄的路徑，與圖片網址的路徑相同
+    entries = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(dirpath, filename)
+            entries.append({
+                "path": path,
+                "fileName": os.path.relpath(path, root).replace(os.sep, "/"),
+                "tags": None,
+                "origin": None,
+            })
+    return entries
+
+
+def read_manifest(manifest: str) -> list:
+    # CSV 欄位: path, fileName (選填), tags (選填), origin (選填)；path 相對於 manifest 所在目錄
+    base = os.path.dirname(os.path.abspath(manifest))
+    entries = []
+    with open(manifest, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            path = os.path.join(base, row["path"])
+            entries.append({
+                "path": path,
+                "fileName": row.get("fileName") or os.path.basename(path),
+                "tags": row.get("tags") or None,
+                "origin": row.get("origin") or None,
+            })
+    return entries
+
+
+def file_digest(path: str) -> tuple:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return round(os.path.getsize(path) / SIZE_UNIT, 2), sha256.hexdigest()
+
+
+def ensure_schema(cursor, table: str):
+    # sha256 用於偵測重複內容，fileName 唯一鍵讓重複執行時可以 upsert
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS sha256 CHAR(64) NULL")
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uniq_{table}_fileName ON {table} (fileName)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_sha256 ON {table} (sha256)")
+
+
+def has_sha256_column(cursor, table: str) -> bool:
+    cursor.execute(f"SHOW COLUMNS FROM {table} LIKE 'sha256'")
+    return cursor.fetchone() is not None
+
+
+def notify_api(key: str):
+    url = os.getenv("IMG_REFRESH_URL") or f"http://{os.getenv('API_HOST')}:{os.getenv('API_PORT')}/api/img/refresh"
+    request = urllib.request.Request(url, data=json.dumps({"key": key}).encode(), headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            logging.info(f"API notified to refresh image catalog ({response.status}).")
+    except Exception as e:
+        logging.warning(f"Unable to notify API, catalog will refresh on its next interval: {e}")
+
+
+def ingest(entries: list, table: str, dry_run: bool = False) -> dict:
+    stats = {"scanned": len(entries), "upserted": 0, "unchanged": 0, "duplicates": 0}
+
+    # 計算大小與雜湊 (hashlib 會釋放 GIL，用執行緒平行處理)
+    with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2) as executor:
+        for entry, (size, sha256) in zip(entries, executor.map(file_digest, [entry["path"] for entry in entries])):
+            entry["size"], entry["sha256"] = size, sha256
+
+    conn = pool.connection(shareable=False)
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        # MariaDB 的 DDL 會自動 commit，dry-run 時不修改資料表結構
+        if dry_run:
+            sha256_column = "sha256" if has_sha256_column(cursor, table) else "NULL AS sha256"
+        else:
+            ensure_schema(cursor, table)
+            sha256_column = "sha256"
+        cursor.execute(f"SELECT fileName, {sha256_column}, tags, origin FROM {table}")
+        existing = {row["fileName"]: row for row in cursor.fetchall()}
+        known_hashes = {row["sha256"]: fileName for fileName, row in existing.items() if row["sha256"]}
+
+        rows = []
+        for entry in entries:
+            current = existing.get(entry["fileName"])
+            # 未提供的 tags / origin 會保留資料庫中的值 (見下方的 COALESCE)，只比對有提供的欄位
+            if (
+                current is not None
+                and current["sha256"] == entry["sha256"]
+                and entry["tags"] in (None, current["tags"])
+                and entry["origin"] in (None, current["origin"])
+            ):
+                stats["unchanged"] += 1
+                continue
+            # 內容相同但檔名不同的檔案 (包含同一批次中) 只保留第一個
+            owner = known_hashes.get(entry["sha256"])
+            if owner and owner != entry["fileName"]:
+                logging.warning(f"Skip duplicate content: {entry['fileName']} (same as {owner})")
+                stats["duplicates"] += 1
+                continue
+            known_hashes[entry["sha256"]] = entry["fileName"]
+            rows.append((entry["fileName"], entry["size"], entry["tags"], entry["origin"], entry["sha256"]))
+
+        if dry_run:
+            stats["upserted"] = len(rows)
+            return stats
+
+        query = f"""
+            INSERT INTO {table} (fileName, size, tags, origin, sha256, updateAt)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                size = VALUES(size),
+                sha256 = VALUES(sha256),
+                tags = COALESCE(VALUES(tags), tags),
+                origin = COALESCE(VALUES(origin), origin),
+                updateAt = NOW()
+        """
+        for start in range(0, len(rows), BATCH_SIZE):
+            chunk = rows[start:start + BATCH_SIZE]
+            try:
+                cursor.executemany(query, chunk)
+                conn.commit()
+            except pymysql.Error:
+                conn.rollback()
+                raise
+            stats["upserted"] += len(chunk)
+            logging.info(f"Committed {stats['upserted']}/{len(rows)} rows into {table}.")
+        return stats
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingest images into the image catalog tables.")
+    parser.add_argument("source", help="Image directory, or a CSV manifest when --manifest is set")
+    parser.add_argument("--manifest", action="store_true", help="Treat source as a CSV manifest (path,fileName,tags,origin)")
+    parser.add_argument("--table", choices=["image", "image_phone"], default="image")
+    parser.add_argument("--key", default=os.getenv("IMG_REFRESH_KEY"), help="API key used to trigger /img/refresh")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be written")
+    args = parser.parse_args()
+
+    entries = read_manifest(args.source) if args.manifest else scan_directory(args.source)
+    stats = ingest(entries, args.table, dry_run=args.dry_run)
+    logging.info(f"Ingest finished: {stats}")
+
+    if not args.dry_run and stats["upserted"] and args.key:
+        notify_api(args.key)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
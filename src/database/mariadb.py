@@ -59,3 +59,10 @@ async def get_mariadb_connect():
     conn = pool.connection()  # 使用同步方法來獲取連接
     cursor = conn.cursor(pymysql.cursors.DictCursor)  # 使用字典游標
     return conn, cursor  # 返回連接和游標
+
+
+def get_mariadb_stream_connect():
+    # 取得獨佔連線與伺服器端游標，讓大量資料可以分批讀取而不必一次載入記憶體
+    conn = pool.connection(shareable=False)
+    cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+    return conn, cursor
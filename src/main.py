@@ -9,6 +9,9 @@ import redis.asyncio as redis
 from src.database.mariadb import check_mariadb_connect
 from src.database.mongodb import check_mongodb_connect
 from src.utils.counter import check_counter
+from src.utils.sensorstore import create_sensor_db
+from src.utils.sensorwire import start_sensor_udp_listener
+from src.utils.imgcatalog import load_image_catalogs
 from src.utils.backgroundtask import start_background_tasks, stop_background_tasks
 
 
@@ -19,11 +22,16 @@ async def lifespan(_: FastAPI):
     await check_mariadb_connect()
     await check_mongodb_connect()
     check_counter()
+    create_sensor_db()
+    await load_image_catalogs()
     logging.info("Done!")
     global start_time
     start_time = int(time.time())
     await start_background_tasks()
+    sensor_udp = await start_sensor_udp_listener()
     yield
+    if sensor_udp is not None:
+        sensor_udp.close()
     await stop_background_tasks()
     await FastAPILimiter.close()
 
@@ -1,15 +1,23 @@
-from fastapi import Depends, APIRouter, HTTPException, Query
+from fastapi import Depends, APIRouter, HTTPException, Query, Header, Response
 from fastapi.responses import JSONResponse
 from fastapi.responses import RedirectResponse
+from fastapi.responses import StreamingResponse
 from fastapi_limiter.depends import RateLimiter
 from pydantic import BaseModel
 from typing import Union, Optional
 from src.database.mongodb import connect_to_mongodb
 from src.utils.counter import update_counter
-from src.database.mariadb import get_mariadb_connect
+from src.database.mariadb import get_mariadb_connect, get_mariadb_stream_connect
+from src.utils.auth import check_api_key
+from src.utils.imgcatalog import get_catalog, parse_tags, request_catalog_refresh
 import logging
 import datetime
-import random
+import base64
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
 
 router = APIRouter()
 
@@ -29,73 +37,256 @@ class ImgListJSONResponse(BaseModel):
     time: int
     data: dict
 
-@router.get("/img", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
-async def img_desktop(type: Union[str, None] = None, tag: Union[str, None] = None) -> Optional[ImgJSONResponse]:
-    conn, cursor = await get_mariadb_connect()
+class ImgRefreshRequest(BaseModel):
+    key: str
+
+IMG_URL_PREFIX = {
+    "image": "https://img.redbean0721.com/img/desktop/",
+    "image_phone": "https://img.redbean0721.com/img/phone/",
+}
+STREAM_CHUNK_SIZE = 500  # 串流輸出時每次從資料庫讀取的筆數
+PAGE_CACHE_SIZE = 512    # 最多保留幾個已序列化的列表頁面
+# 同時進行的全量串流數；每個串流在下載期間獨佔一個資料庫連線，需低於連線池上限 (10)
+STREAM_LIMIT = int(os.getenv("IMG_STREAM_LIMIT", 4))
+_stream_slots = threading.BoundedSemaphore(STREAM_LIMIT)
+
+# (資料表, page, pageSize, cursor, fields, 目錄版本) -> 已序列化的回應內容
+page_cache = OrderedDict()
+
+def _page_cache_get(key):
+    body = page_cache.get(key)
+    if body is not None:
+        page_cache.move_to_end(key)
+    return body
+
+def _page_cache_put(key, body: bytes):
+    page_cache[key] = body
+    if len(page_cache) > PAGE_CACHE_SIZE:
+        page_cache.popitem(last=False)
 
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
     try:
-        cursor.execute("SELECT MAX(id) AS max_id FROM image")
-        max_id = cursor.fetchone()["max_id"]
-        if max_id is None:
-            raise HTTPException(status_code=500, detail="No images found in the database.")
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        if not value.startswith("id:"):
+            raise ValueError(value)
+        return int(value[3:])
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor parameter.")
 
-        cursor.execute("SELECT * FROM image WHERE id = %s", (random.randint(1, max_id),))
-        image = cursor.fetchone()
+# 每個輸出欄位的取值方式；image 為圖片目錄或資料庫中的資料
+IMAGE_FIELDS = {
+    "id": lambda table, image: image["id"],
+    "fileName": lambda table, image: image["fileName"],
+    "url": lambda table, image: IMG_URL_PREFIX[table] + image["fileName"],
+    "size": lambda table, image: image["size"],
+    "tag": lambda table, image: image["tags"],
+    "updateAt": lambda table, image: image["updateAt"],
+    "origin": lambda table, image: image["origin"],
+}
+LIST_IMAGE_FIELDS = {
+    "id": lambda table, image: image["id"],
+    "url": lambda table, image: IMG_URL_PREFIX[table] + image["fileName"],
+    "fileName": lambda table, image: image["fileName"],
+    "size": lambda table, image: float(image["size"]),
+    "updatedAt": lambda table, image: int(image["updateAt"].timestamp()) if image["updateAt"] else None,
+    "origin": lambda table, image: image["origin"],
+    "tags": lambda table, image: image["tags"] or "",
+}
+# 輸出欄位 -> 需要讀取的資料表欄位
+FIELD_COLUMNS = {
+    "id": "id",
+    "fileName": "fileName",
+    "url": "fileName",
+    "size": "size",
+    "tag": "tags",
+    "tags": "tags",
+    "updateAt": "updateAt",
+    "updatedAt": "updateAt",
+    "origin": "origin",
+}
 
-        if type == "json":
-            return JSONResponse(content={
-                "id": image["id"],
-                "fileName": image["fileName"],
-                "url": "https://img.redbean0721.com/img/desktop/" + image["fileName"],
-                "size": float(image["size"]),
-                "tag": image["tags"],
-                "updateAt": int(image["updateAt"].timestamp()) if image["updateAt"] else None,
-                "origin": image["origin"]
-            }, status_code=200)
-        else:
-            response = RedirectResponse(url="https://img.redbean0721.com/img/desktop/" + image["fileName"], status_code=302)
-            response.headers["Cache-Control"] = "no-revalidate, max-age=0"
-            return response
+def parse_fields(fields: Optional[str], allowed: dict) -> Optional[tuple]:
+    if not fields:
+        return None
+    selected = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in selected if field not in allowed]
+    if not selected or unknown:
+        raise HTTPException(status_code=422, detail=f"Invalid fields parameter, allowed: {', '.join(allowed)}")
+    return selected
+
+def select_columns(fields: Optional[tuple]) -> str:
+    # id 一定要查，cursor 分頁需要用到
+    if fields is None:
+        return "*"
+    return ", ".join(dict.fromkeys(["id"] + [FIELD_COLUMNS[field] for field in fields]))
+
+def serialize_image(table: str, image: dict, fields: Optional[tuple] = None) -> dict:
+    return {field: IMAGE_FIELDS[field](table, image) for field in fields or IMAGE_FIELDS}
+
+def serialize_list_image(table: str, image: dict, fields: Optional[tuple] = None) -> dict:
+    return {field: LIST_IMAGE_FIELDS[field](table, image) for field in fields or LIST_IMAGE_FIELDS}
+
+def _stream_rows(table: str, head: str, tail: str, format: str, fields: Optional[tuple]):
+    conn, cursor = get_mariadb_stream_connect()
+    try:
+        cursor.execute(f"SELECT {select_columns(fields)} FROM {table} ORDER BY id DESC")
+        yield head
+        separator = ""
+        while True:
+            images = cursor.fetchmany(STREAM_CHUNK_SIZE)
+            if not images:
+                break
+            items = [json.dumps(serialize_list_image(table, image, fields), ensure_ascii=False) for image in images]
+            if format == "ndjson":
+                yield "\n".join(items) + "\n"
+            else:
+                yield separator + ",".join(items)
+                separator = ","
+        yield tail
     except Exception as e:
-        logging.error(f"Error fetching image: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+        # 串流已開始，狀態碼無法再更改：重新拋出讓連線中斷，避免不完整的列表看起來像是完整的
+        logging.error(f"Error streaming {table} list: {str(e)}")
+        raise
     finally:
         cursor.close()
+        conn.close()
 
-@router.get("/img/list", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
-async def img_desktop_list(page: int = Query(1, ge=1, description="Page number, must >= 1"), pageSize: int = Query(20, description="Page size, must be -1 (for all) or >=1")) -> Optional[ImgListJSONResponse]:
+class LimitedStream:
+    """佔用一個串流名額的 iterator，讀完、被關閉或從未開始就被回收時都會歸還名額"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._release = weakref.finalize(self, _stream_slots.release)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._rows)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._rows.close()
+        self._release()
+
+def limited_stream(rows, media_type: str):
+    if not _stream_slots.acquire(blocking=False):
+        rows.close()
+        return JSONResponse(content={"detail": "Too many concurrent full-list downloads, please retry later."}, status_code=503, headers={"Retry-After": "30"})
+    return StreamingResponse(LimitedStream(rows), media_type=media_type)
+
+async def stream_images(table: str, page: int, format: str, fields: Optional[tuple]):
+    catalog = get_catalog(table)
+    if catalog.loaded:
+        total = len(catalog)
+    else:
+        conn, db_cursor = await get_mariadb_connect()
+        try:
+            db_cursor.execute(f"SELECT COUNT(*) as total FROM {table}")
+            total = db_cursor.fetchone()["total"]
+        finally:
+            db_cursor.close()
+            conn.close()
+
+    if format == "ndjson":
+        return limited_stream(_stream_rows(table, "", "", format, fields), "application/x-ndjson")
+
+    # 先輸出外層結構，imgs 陣列內容再分批補上
+    envelope = json.dumps({
+        "status": True,
+        "code": 200,
+        "msg": "获取成功",
+        "time": int(datetime.datetime.now().timestamp() * 1000),
+        "data": {
+            "totalCount": total,
+            "totalPages": 1,
+            "page": page,
+            "pageSize": -1,
+            "nextCursor": None,
+            "imgs": []
+        }
+    }, ensure_ascii=False)
+    head, tail = envelope.rsplit("[]", 1)
+    return limited_stream(_stream_rows(table, head + "[", "]" + tail, format, fields), "application/json")
+
+def batch_images(table: str, n: int, tag: Optional[str], tagMode: str, fields: Optional[str]):
+    selected = parse_fields(fields, IMAGE_FIELDS)
+    tags = parse_tags(tag)
+    images = get_catalog(table).sample(n, tags, match_all=tagMode == "all")
+    if not images and tags:
+        return JSONResponse(content={"detail": "No images found with the given tag."}, status_code=404)
+    return JSONResponse(content={
+        "status": True,
+        "code": 200,
+        "msg": "获取成功",
+        "time": int(datetime.datetime.now().timestamp() * 1000),
+        "data": {
+            "count": len(images),
+            "imgs": [serialize_image(table, image, selected) for image in images]
+        }
+    }, status_code=200)
+
+async def list_images(table: str, page: int, pageSize: int, cursor: Optional[str], format: str = "json", if_none_match: Optional[str] = None, fields: Optional[str] = None):
     if page < 1 or (pageSize != -1 and pageSize < 1):
         raise HTTPException(status_code=422, detail="Invalid page or pageSize parameter.")
-    conn, cursor = await get_mariadb_connect()
+    selected = parse_fields(fields, LIST_IMAGE_FIELDS)
+    last_id = decode_cursor(cursor) if cursor else None
+
+    # 目錄版本沒變，同一個網址的內容就不會變，可直接回 304 或使用已序列化的頁面
+    catalog = get_catalog(table)
+    etag = f'"{table}-{catalog.version}"' if catalog.loaded else None
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if etag and etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=cache_headers)
+
+    if pageSize == -1:
+        response = await stream_images(table, page, format, selected)
+        if response.status_code == 200:
+            response.headers.update(cache_headers)
+        return response
+
+    cache_key = (table, page, pageSize, last_id, selected, catalog.version)
+    body = _page_cache_get(cache_key) if etag else None
+    if body is not None:
+        return Response(content=body, media_type="application/json", headers=cache_headers)
+
+    conn, db_cursor = await get_mariadb_connect()
     try:
-        # 查總筆數
-        cursor.execute("SELECT COUNT(*) as total FROM image")
-        total = cursor.fetchone()["total"]
+        # 總筆數直接取自圖片目錄，目錄有變動時才會改變
+        if catalog.loaded:
+            total = len(catalog)
+        else:
+            db_cursor.execute(f"SELECT COUNT(*) as total FROM {table}")
+            total = db_cursor.fetchone()["total"]
 
-        # 如果 pageSize = -1, 全部資料
-        if pageSize == -1:
-            cursor.execute("SELECT * FROM image ORDER BY id DESC")
+        # 有 cursor 時用 id < last_id 取代 OFFSET，深頁成本與第一頁相同
+        # 多取一筆用來判斷是否還有下一頁
+        if last_id is not None:
+            db_cursor.execute(f"SELECT {select_columns(selected)} FROM {table} WHERE id < %s ORDER BY id DESC LIMIT %s", (last_id, pageSize + 1))
         else:
             offset = (page - 1) * pageSize
-            cursor.execute("SELECT * FROM image ORDER BY id DESC LIMIT %s OFFSET %s", (pageSize, offset))
-        
-        images = cursor.fetchall()
-
-        data_list = []
-        for image in images:
-            data_list.append({
-                "id": image["id"],
-                "url": "https://img.redbean0721.com/img/desktop/" + image["fileName"],
-                "fileName": image["fileName"],
-                "size": float(image["size"]),
-                "updatedAt": int(image["updateAt"].timestamp()) if image["updateAt"] else None,
-                "origin": image["origin"],
-                "tags": image["tags"] or ""
-            })
-
-        total_pages = 1 if pageSize == -1 else (total + pageSize - 1) // pageSize
-
-        return JSONResponse(content={
+            db_cursor.execute(f"SELECT {select_columns(selected)} FROM {table} ORDER BY id DESC LIMIT %s OFFSET %s", (pageSize + 1, offset))
+
+        images = db_cursor.fetchall()
+        has_more = len(images) > pageSize
+        if has_more:
+            images = images[:pageSize]
+
+        data_list = [serialize_list_image(table, image, selected) for image in images]
+        total_pages = (total + pageSize - 1) // pageSize
+
+        body = json.dumps({
             "status": True,
             "code": 200,
             "msg": "获取成功",
@@ -105,97 +296,87 @@ async def img_desktop_list(page: int = Query(1, ge=1, description="Page number,
                 "totalPages": total_pages,
                 "page": page,
                 "pageSize": pageSize,
+                "nextCursor": encode_cursor(images[-1]["id"]) if has_more else None,
                 "imgs": data_list
             }
-        })
+        }, ensure_ascii=False).encode("utf-8")
+        if etag:
+            _page_cache_put(cache_key, body)
+        return Response(content=body, media_type="application/json", headers=cache_headers)
     except Exception as e:
-        logging.error(f"Error fetching image list: {str(e)}")
+        logging.error(f"Error fetching {table} list: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
     finally:
-        cursor.close()
-
-@router.get("/img-phone", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
-async def img_phone(type: Union[str, None] = None, tag: Union[str, None] = None) -> Optional[ImgJSONResponse]:
-    conn, cursor = await get_mariadb_connect()
+        db_cursor.close()
+        conn.close()
 
+@router.get("/img", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
+async def img_desktop(type: Union[str, None] = None, tag: Union[str, None] = None, tagMode: str = Query("any", pattern="^(any|all)$", description="Match any or all of the comma separated tags"), fields: Union[str, None] = Query(None, description="Comma separated fields to return, e.g. id,url")) -> Optional[ImgJSONResponse]:
+    selected = parse_fields(fields, IMAGE_FIELDS)
     try:
-        cursor.execute("SELECT MAX(id) AS max_id FROM image_phone")
-        max_id = cursor.fetchone()["max_id"]
-        if max_id is None:
+        # 從記憶體中的圖片目錄隨機抽取，不需查詢資料庫
+        tags = parse_tags(tag)
+        image = get_catalog("image").random_image(tags, match_all=tagMode == "all")
+        if image is None:
+            if tags:
+                return JSONResponse(content={"detail": "No images found with the given tag."}, status_code=404)
             raise HTTPException(status_code=500, detail="No images found in the database.")
 
-        cursor.execute("SELECT * FROM image_phone WHERE id = %s", (random.randint(1, max_id),))
-        image = cursor.fetchone()
-
         if type == "json":
-            return JSONResponse(content={
-                "id": image["id"],
-                "fileName": image["fileName"],
-                "url": "https://img.redbean0721.com/img/phone/" + image["fileName"],
-                "size": float(image["size"]),
-                "tag": image["tags"],
-                "updateAt": int(image["updateAt"].timestamp()) if image["updateAt"] else None,
-                "origin": image["origin"]
-            }, status_code=200)
+            return JSONResponse(content=serialize_image("image", image, selected), status_code=200)
         else:
-            response = RedirectResponse(url="https://img.redbean0721.com/img/phone/" + image["fileName"], status_code=302)
+            response = RedirectResponse(url=IMG_URL_PREFIX["image"] + image["fileName"], status_code=302)
             response.headers["Cache-Control"] = "no-revalidate, max-age=0"
             return response
     except Exception as e:
-        logging.error(f"Error fetching phone image: {str(e)}")
+        logging.error(f"Error fetching image: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
-    finally:
-        cursor.close()
 
+@router.get("/img/batch", dependencies=[Depends(RateLimiter(times=20, seconds=60))])
+async def img_desktop_batch(n: int = Query(10, ge=1, le=50, description="Number of distinct random images"), tag: Union[str, None] = None, tagMode: str = Query("any", pattern="^(any|all)$", description="Match any or all of the comma separated tags"), fields: Union[str, None] = Query(None, description="Comma separated fields to return, e.g. id,url")) -> Optional[ImgListJSONResponse]:
+    return batch_images("image", n, tag, tagMode, fields)
 
-@router.get("/img-phone/list", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
-async def img_phone_list(page: int = Query(1, ge=1, description="Page number, must >= 1"), pageSize: int = Query(20, description="Page size, must be -1 (for all) or >=1")) -> Optional[ImgListJSONResponse]:
-    if page < 1 or (pageSize != -1 and pageSize < 1):
-        raise HTTPException(status_code=422, detail="Invalid page or pageSize parameter.")
-    conn, cursor = await get_mariadb_connect()
+@router.get("/img/list", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
+async def img_desktop_list(page: int = Query(1, ge=1, description="Page number, must >= 1"), pageSize: int = Query(20, description="Page size, must be -1 (for all) or >=1"), cursor: Union[str, None] = Query(None, description="Opaque cursor from a previous nextCursor"), format: str = Query("json", pattern="^(json|ndjson)$", description="Output format when pageSize is -1"), fields: Union[str, None] = Query(None, description="Comma separated fields to return, e.g. id,url"), if_none_match: Union[str, None] = Header(None)) -> Optional[ImgListJSONResponse]:
+    return await list_images("image", page, pageSize, cursor, format, if_none_match, fields)
+
+@router.get("/img-phone", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
+async def img_phone(type: Union[str, None] = None, tag: Union[str, None] = None, tagMode: str = Query("any", pattern="^(any|all)$", description="Match any or all of the comma separated tags"), fields: Union[str, None] = Query(None, description="Comma separated fields to return, e.g. id,url")) -> Optional[ImgJSONResponse]:
+    selected = parse_fields(fields, IMAGE_FIELDS)
     try:
-        # 查總筆數
-        cursor.execute("SELECT COUNT(*) as total FROM image_phone")
-        total = cursor.fetchone()["total"]
+        # 從記憶體中的圖片目錄隨機抽取，不需查詢資料庫
+        tags = parse_tags(tag)
+        image = get_catalog("image_phone").random_image(tags, match_all=tagMode == "all")
+        if image is None:
+            if tags:
+                return JSONResponse(content={"detail": "No images found with the given tag."}, status_code=404)
+            raise HTTPException(status_code=500, detail="No images found in the database.")
 
-        # 如果 pageSize = -1, 全部資料
-        if pageSize == -1:
-            cursor.execute("SELECT * FROM image_phone ORDER BY id DESC")
+        if type == "json":
+            return JSONResponse(content=serialize_image("image_phone", image, selected), status_code=200)
         else:
-            offset = (page - 1) * pageSize
-            cursor.execute("SELECT * FROM image_phone ORDER BY id DESC LIMIT %s OFFSET %s", (pageSize, offset))
-        
-        images = cursor.fetchall()
-
-        data_list = []
-        for image in images:
-            data_list.append({
-                "id": image["id"],
-                "url": "https://img.redbean0721.com/img/phone/" + image["fileName"],
-                "fileName": image["fileName"],
-                "size": float(image["size"]),
-                "updatedAt": int(image["updateAt"].timestamp()) if image["updateAt"] else None,
-                "origin": image["origin"],
-                "tags": image["tags"] or ""
-            })
-
-        total_pages = 1 if pageSize == -1 else (total + pageSize - 1) // pageSize
-
-        return JSONResponse(content={
-            "status": True,
-            "code": 200,
-            "msg": "获取成功",
-            "time": int(datetime.datetime.now().timestamp() * 1000),
-            "data": {
-                "totalCount": total,
-                "totalPages": total_pages,
-                "page": page,
-                "pageSize": pageSize,
-                "imgs": data_list
-            }
-        })
+            response = RedirectResponse(url=IMG_URL_PREFIX["image_phone"] + image["fileName"], status_code=302)
+            response.headers["Cache-Control"] = "no-revalidate, max-age=0"
+            return response
     except Exception as e:
-        logging.error(f"Error fetching phone image list: {str(e)}")
+        logging.error(f"Error fetching phone image: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
-    finally:
-        cursor.close()
+
+
+@router.get("/img-phone/batch", dependencies=[Depends(RateLimiter(times=20, seconds=60))])
+async def img_phone_batch(n: int = Query(10, ge=1, le=50, description="Number of distinct random images"), tag: Union[str, None] = None, tagMode: str = Query("any", pattern="^(any|all)$", description="Match any or all of the comma separated tags"), fields: Union[str, None] = Query(None, description="Comma separated fields to return, e.g. id,url")) -> Optional[ImgListJSONResponse]:
+    return batch_images("image_phone", n, tag, tagMode, fields)
+
+
+@router.get("/img-phone/list", dependencies=[Depends(RateLimiter(times=80, seconds=60))])
+async def img_phone_list(page: int = Query(1, ge=1, description="Page number, must >= 1"), pageSize: int = Query(20, description="Page size, must be -1 (for all) or >=1"), cursor: Union[str, None] = Query(None, description="Opaque cursor from a previous nextCursor"), format: str = Query("json", pattern="^(json|ndjson)$", description="Output format when pageSize is -1"), fields: Union[str, None] = Query(None, description="Comma separated fields to return, e.g. id,url"), if_none_match: Union[str, None] = Header(None)) -> Optional[ImgListJSONResponse]:
+    return await list_images("image_phone", page, pageSize, cursor, format, if_none_match, fields)
+
+
+@router.post("/img/refresh", dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+async def img_refresh(data: ImgRefreshRequest):
+    await check_api_key(data.key, "img_refresh")
+
+    # 交給背景任務刷新，短時間內多次觸發只會刷新一次
+    request_catalog_refresh()
+    return JSONResponse(content={"message": "Image catalog refresh scheduled"}, status_code=202)
@@ -1,13 +1,18 @@
-from fastapi import Depends, APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import Depends, APIRouter, Path, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi_limiter.depends import RateLimiter
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from fastapi import APIRouter, Query, Depends
 from typing import List, Optional
-import datetime, time
-from mcstatus import JavaServer, BedrockServer
-from mcclient import SLPClient, QueryClient
+import datetime, time, json
+from src.utils.mcprobe import probe_status, status_content, failure_content, bulk_probe, DEFAULT_PORTS, hedge_wins
+from src.utils.mcbreaker import breaker
+from src.utils.mcicon import get_icon
+from src.utils.mcdns import dns_stats
+from src.utils.mcwatch import is_watched, query_history
+from src.utils.rconpool import rcon_pool
 import aiomcrcon
+import asyncio
 import logging
 
 router = APIRouter()
@@ -31,128 +36,119 @@ class MinecraftStatusResponse(BaseModel):
     software: Optional[str] = None
     map: Optional[str] = None
     query_time: int
+    cached: bool = False
+    age: Optional[float] = None
+    backend: Optional[str] = None
     
 
+@router.get("/minecraft/status/java", dependencies=[Depends(RateLimiter(times=60, seconds=300))])
+async def minecraft_status_java(host: str, port: int = Query(25565, ge=1, le=65535)) -> MinecraftStatusResponse:
+    # 同時使用 mcstatus 與 mcclient (hedged request)，回傳最先成功的結果，backend 欄位為勝出的後端
+    query_time = int(time.time())
+    try:
+        status, cached, age = await probe_status("java", host, port, "hedged")
+        return JSONResponse(content=status_content(status, cached, age), status_code=200)
+    except Exception as e:
+        logging.warning(repr(e))
+        return JSONResponse(content=failure_content(e, host, port, query_time), status_code=504)
+
+
 @router.get("/minecraft/status/java/mcstatus", dependencies=[Depends(RateLimiter(times=60, seconds=300))])
 async def minecraft_status_java_mcstatus(host: str, port: int = Query(25565, ge=1, le=65535)) -> MinecraftStatusResponse:
     query_time = int(time.time())
     try:
-        address = host if port == 25565 else f"{host}:{port}"
-        server = JavaServer.lookup(address=address)
-        status = server.status()
-
-        # 嘗試查詢伺服器的更多信息
-        query = None
-        try:
-            query = server.query()
-        except Exception as query_exception:
-            logging.warning(f"Query failed: {query_exception}")
-            query = None  # 如果 query 失敗，將 query 設為 None
-
-        return JSONResponse(content={
-            "online": True,
-            "host": host,
-            "port": port,
-            "version": status.version.name,
-            "players": {
-                "online": status.players.online,
-                "max": status.players.max,
-                "list": [player.name for player in status.players.sample or []]
-            },
-            "motd": status.description,
-            "latency": round(status.latency, 2),
-            "icon": status.favicon if hasattr(status, "favicon") else None,
-            "plugins": query.software.plugins if query else [],
-            "mods": [],
-            "software": query.software.brand if query else None,
-            "query_time": query_time,
-        }, status_code=200)
+        status, cached, age = await probe_status("java", host, port, "mcstatus")
+        return JSONResponse(content=status_content(status, cached, age), status_code=200)
     except Exception as e:
-        logging.warning(e)
-        return JSONResponse(content={
-            "online": False,
-            "host": host,
-            "port": port,
-            "query_time": query_time
-        }, status_code=504)
+        logging.warning(repr(e))
+        return JSONResponse(content=failure_content(e, host, port, query_time), status_code=504)
 
 
 @router.get("/minecraft/status/java/mcclient", dependencies=[Depends(RateLimiter(times=60, seconds=300))])
 async def minecraft_status_java_mcclient(host: str, port: int = Query(25565, ge=1, le=65535)) -> MinecraftStatusResponse:
     query_time = int(time.time())
     try:
-        address = host if port == 25565 else f"{host}:{port}"
-        # 嘗試建立 SLP 客戶端來獲取伺服器狀態
-        slp_client = SLPClient(host, port)
-        status = slp_client.get_status()
-
-        # 嘗試建立 Query 客戶端來獲取額外信息
-        query = None
-        try:
-            query_client = QueryClient(host, port)
-            query = query_client.get_status()
-        except Exception as query_exception:
-            logging.warning(f"Query failed: {query_exception}")
-            query = None  # 如果 Query 失敗，將 query 設為 None
-
-        return JSONResponse(content={
-            "online": True,
-            "host": status.host,
-            "port": status.port,
-            "version": status.version.name,
-            "players": {
-                "online": status.players.online,
-                "max": status.players.max,
-                "list": status.players.list
-            },
-            "motd": status.motd,
-            "latency": None,
-            "icon": status.favicon if hasattr(status, "favicon") else None,
-            "plugins": query.plugins if query else [],
-            "mods": [],
-            "software": None,
-            "query_time": query_time,
-        }, status_code=200)
+        status, cached, age = await probe_status("java", host, port, "mcclient")
+        return JSONResponse(content=status_content(status, cached, age), status_code=200)
     except Exception as e:
-        logging.warning(f"SLP failed: {e}")
-        return JSONResponse(content={
-            "online": False,
-            "host": host,
-            "port": port,
-            "query_time": query_time
-        }, status_code=504)
+        logging.warning(f"SLP failed: {e!r}")
+        return JSONResponse(content=failure_content(e, host, port, query_time), status_code=504)
 
 @router.get("/minecraft/status/bedrock", dependencies=[Depends(RateLimiter(times=60, seconds=300))])
 async def minecraft_status_bedrock(host: str, port: int = Query(19132, ge=1, le=65535)) -> MinecraftStatusResponse:
     query_time = int(time.time())
     try:
-        server = BedrockServer.lookup(address=f"{host}:{port}")
-        status = server.status()
-        return JSONResponse(content={
-            "online": True,
-            "host": host,
-            "port": port,
-            "version": status.version.name,
-            "players": {
-                "online": status.players.online,
-                "max": status.players.max
-            },
-            "motd": status.description,
-            "latency": round(status.latency, 2),
-            "icon": status.favicon if hasattr(status, "favicon") else None,
-            "plugins": [],
-            "mods": [],
-            "software": None,
-            "query_time": query_time,
-        }, status_code=200)
+        status, cached, age = await probe_status("bedrock", host, port)
+        return JSONResponse(content=status_content(status, cached, age), status_code=200)
     except Exception as e:
-        logging.warning(e)
-        return JSONResponse(content={
-            "online": False,
-            "host": host,
-            "port": port,
-            "query_time": query_time
-        }, status_code=504)
+        logging.warning(repr(e))
+        return JSONResponse(content=failure_content(e, host, port, query_time), status_code=504)
+
+class MinecraftStatusTarget(BaseModel):
+    edition: str = Field("java", pattern="^(java|bedrock)$")
+    host: str
+    port: Optional[int] = Field(None, ge=1, le=65535)  # 未提供時使用該版本的預設埠
+    backend: str = Field("mcstatus", pattern="^(mcstatus|mcclient|hedged)$")  # 只對 java 有效
+
+class MinecraftBulkStatusRequest(BaseModel):
+    targets: List[MinecraftStatusTarget] = Field(..., min_length=1, max_length=500)
+
+@router.post("/minecraft/status/bulk", dependencies=[Depends(RateLimiter(times=10, seconds=300))])
+async def minecraft_status_bulk(request: MinecraftBulkStatusRequest):
+    targets = [
+        (
+            target.edition,
+            target.host,
+            target.port or DEFAULT_PORTS[target.edition],
+            target.backend if target.edition == "java" else "mcstatus",
+        )
+        for target in request.targets
+    ]
+
+    # 每完成一個目標就輸出一行 JSON (NDJSON)，index 對應請求中的順序
+    async def stream():
+        async for result in bulk_probe(targets):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/minecraft/icon/{digest}.png", dependencies=[Depends(RateLimiter(times=300, seconds=60))])
+async def minecraft_icon(digest: str = Path(..., pattern="^[0-9a-f]{64}$")):
+    png = get_icon(digest)
+    if png is None:
+        return JSONResponse(content={"detail": "Icon not found"}, status_code=404)
+    # 網址由內容雜湊產生，內容永遠不會變，可以永久快取
+    return Response(content=png, media_type="image/png", headers={
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{digest}"',
+    })
+
+@router.get("/minecraft/stats", dependencies=[Depends(RateLimiter(times=60, seconds=300))])
+async def minecraft_stats():
+    return JSONResponse(content={"hedgeWins": hedge_wins, "dns": dns_stats()}, status_code=200)
+
+@router.get("/minecraft/breaker", dependencies=[Depends(RateLimiter(times=60, seconds=300))])
+async def minecraft_breaker():
+    # 列出目前有失敗紀錄的目標與其熔斷狀態
+    return JSONResponse(content={"targets": breaker.snapshot()}, status_code=200)
+
+@router.get("/minecraft/history", dependencies=[Depends(RateLimiter(times=60, seconds=300))])
+async def minecraft_history(
+    host: str,
+    edition: str = Query("java", pattern="^(java|bedrock)$"),
+    port: Optional[int] = Query(None, ge=1, le=65535),
+    start: Optional[int] = Query(None, alias="from", description="Unix timestamp, defaults to 24 hours ago"),
+    end: Optional[int] = Query(None, alias="to", description="Unix timestamp, defaults to now"),
+    bucket: Optional[int] = Query(None, ge=60, description="Bucket size in seconds"),
+):
+    port = port or DEFAULT_PORTS[edition]
+    if not is_watched(edition, host, port):
+        return JSONResponse(content={"detail": "Server is not in the watchlist"}, status_code=404)
+    end = end or int(time.time())
+    start = start or end - 86400
+    if start >= end:
+        return JSONResponse(content={"detail": "'from' must be earlier than 'to'"}, status_code=422)
+    return JSONResponse(content=query_history(edition, host, port, start, end, bucket), status_code=200)
 
 class MinecraftRconRequest(BaseModel):
     host: str
@@ -165,37 +161,72 @@ class MinecraftRconResponse(BaseModel):
     code: int
     msg: str
 
+class MinecraftRconBatchRequest(BaseModel):
+    host: str
+    port: int = Query(25575, ge=1, le=65535)
+    password: str
+    cmds: List[str] = Field(..., min_length=1, max_length=100)
+    stream: bool = False  # 為 True 時每執行完一個指令就以 NDJSON 輸出一行
+
+class MinecraftRconBatchResponse(BaseModel):
+    status: bool
+    code: int
+    results: List[dict]
+
+def rcon_error(e: Exception) -> tuple:
+    if isinstance(e, (aiomcrcon.RCONConnectionError, aiomcrcon.ClientNotConnectedError, asyncio.TimeoutError, asyncio.IncompleteReadError, OSError)):
+        return 504, "Failed to establish connection with the RCON server."
+    if isinstance(e, aiomcrcon.IncorrectPasswordError):
+        return 401, "Incorrect RCON password provided."
+    logging.error(e)
+    return 500, f"Unexpected error: {str(e)}"
+
 @router.post("/minecraft/rcon", dependencies=[Depends(RateLimiter(times=100, seconds=300))])
 async def minecraft_rcon(request: MinecraftRconRequest) -> MinecraftRconResponse:
     try:
-        client = aiomcrcon.Client(host=request.host, port=request.port, password=request.password)
-        await client.connect()
-        response = await client.send_cmd(request.cmd)
-        await client.close()
+        # 使用連線池中已驗證的連線，重複送指令時不必重新連線與驗證
+        response = await rcon_pool.send(request.host, request.port, request.password, request.cmd)
         return JSONResponse(content={
             "status": True,
             "code": 200,
             "msg": response
         }, status_code=200)
-    except aiomcrcon.RCONConnectionError:
-        await client.close()
-        return JSONResponse(content={
-            "status": False,
-            "code": 504,
-            "msg": "Failed to establish connection with the RCON server."
-        }, status_code=504)
-    except aiomcrcon.IncorrectPasswordError:
-        await client.close()
-        return JSONResponse(content={
-            "status": False,
-            "code": 401,
-            "msg": "Incorrect RCON password provided."
-        }, status_code=401)
     except Exception as e:
-        await client.close()
-        logging.error(e)
+        code, msg = rcon_error(e)
         return JSONResponse(content={
             "status": False,
-            "code": 500,
-            "msg": f"Unexpected error: {str(e)}"
-        }, status_code=500)
+            "code": code,
+            "msg": msg
+        }, status_code=code)
+
+async def rcon_batch_results(request: MinecraftRconBatchRequest):
+    # 整批指令在同一個連線上依序執行，期間不會有其他請求插入指令
+    index = 0
+    try:
+        async with rcon_pool.session(request.host, request.port, request.password) as entry:
+            for index, cmd in enumerate(request.cmds):
+                response = await entry.send(cmd)
+                yield {"index": index, "cmd": cmd, "status": True, "code": 200, "msg": response}
+    except Exception as e:
+        # 失敗後連線狀態不明，剩下的指令不再執行
+        code, msg = rcon_error(e)
+        yield {"index": index, "cmd": request.cmds[index], "status": False, "code": code, "msg": msg}
+        for index in range(index + 1, len(request.cmds)):
+            yield {"index": index, "cmd": request.cmds[index], "status": False, "code": 409, "msg": "Skipped after a previous command failed."}
+
+@router.post("/minecraft/rcon/batch", dependencies=[Depends(RateLimiter(times=20, seconds=300))])
+async def minecraft_rcon_batch(request: MinecraftRconBatchRequest) -> MinecraftRconBatchResponse:
+    if request.stream:
+        async def stream():
+            async for result in rcon_batch_results(request):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    results = [result async for result in rcon_batch_results(request)]
+    failed = next((result for result in results if not result["status"]), None)
+    code = failed["code"] if failed else 200
+    return JSONResponse(content={
+        "status": failed is None,
+        "code": code,
+        "results": results
+    }, status_code=code)
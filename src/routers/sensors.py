@@ -1,86 +1,225 @@
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Query, Request, Response
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi_limiter.depends import RateLimiter
-from pydantic import BaseModel
-import datetime
-from src.utils.auth import verify_api_key, permission_check
-from src.database.mariadb import query_in_mariadb
-from typing import Union
-import json
+from pydantic import BaseModel, Field
+import asyncio, json, logging, time, zlib
+from src.utils.auth import check_api_key
+from src.utils.sensorstore import append_reading, append_readings, format_reading, iter_readings, get_reading, get_readings, bucket_count, query_aggregate, MAX_POINTS, sensor_exists, find_item, get_all_readings
+from src.utils.sensorwire import FrameError, ingest_frame, MAX_CLOCK_SKEW
+from src.utils.sensorbroker import broker, MAX_SUBSCRIBERS
+from typing import List, Optional, Union
 
 router = APIRouter()
 
+HEARTBEAT_INTERVAL = 15  # 訂閱連線沒有新資料時，每隔幾秒送出心跳
+
 class TemperatureHumidityData(BaseModel):
     key: str
     temperature: float
     humidity: float
 
+class TemperatureHumidityReading(BaseModel):
+    temperature: float
+    humidity: float
+    time: Optional[int] = Field(None, gt=0, description="Unix timestamp of the reading, defaults to now")
+
+class TemperatureHumidityBatch(BaseModel):
+    key: str
+    readings: List[TemperatureHumidityReading] = Field(..., min_length=1, max_length=10000)
+
+async def authorize_sensor(key: str) -> str:
+    """驗證上傳用的 API Key，回傳對應的感測器名稱 (api_keys.description)"""
+    # 驗證、權限與感測器名稱只需一次查詢
+    row = await check_api_key(key, "post_temp_hum")
+    return row["description"]
+
 @router.post("/post_temp_hum", dependencies=[Depends(RateLimiter(times=100, seconds=60))])
 async def post_temp_hum(data: TemperatureHumidityData):
-    if not verify_api_key(data.key):
-        raise HTTPException(status_code=401, detail="Invalid API Key")
-    if not permission_check(data.key, "post_temp_hum"):
-        raise HTTPException(status_code=403, detail="Insufficient permissions")
-
-    sensor = query_in_mariadb(query="SELECT description FROM api_keys WHERE api_key = ?", values=(data.key,))[0][0]
-
-    # 將數據添加到 db.json 中
-    with open('db.json', 'r+') as file:
-        db_data = json.load(file)
-        if sensor not in db_data:
-            db_data[sensor] = []
-
-        temp_hum_data = {
-            "id": len(db_data[sensor]) + 1,
-            "temperature": data.temperature,
-            "humidity": data.humidity,
-            "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-        db_data[sensor].append(temp_hum_data)
-        file.seek(0)
-        json.dump(db_data, file, indent=4)
+    sensor = await authorize_sensor(data.key)
+
+    # 只附加一筆紀錄，寫入成本與歷史資料量無關
+    entry = append_reading(sensor, int(time.time()), data.temperature, data.humidity)
+    broker.publish(sensor, [entry])
 
     return JSONResponse(content={"message": "Data received and stored successfully"})
 
+@router.post("/post_temp_hum/batch", dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+async def post_temp_hum_batch(data: TemperatureHumidityBatch):
+    # 裝置離線時累積的資料一次上傳：只驗證一次，並在同一個交易中寫入
+    sensor = await authorize_sensor(data.key)
+
+    now = int(time.time())
+    if any(reading.time is not None and reading.time > now + MAX_CLOCK_SKEW for reading in data.readings):
+        raise HTTPException(status_code=422, detail="Reading time is in the future")
+    # 依時間排序後寫入，讓流水號與時間順序一致
+    readings = sorted(
+        ((reading.time if reading.time is not None else now, reading.temperature, reading.humidity) for reading in data.readings),
+        key=lambda reading: reading[0],
+    )
+    stored = append_readings(sensor, readings)
+    broker.publish(sensor, stored)
+
+    return JSONResponse(content={
+        "message": "Data received and stored successfully",
+        "count": len(stored),
+        "firstId": stored[0]["id"],
+        "lastId": stored[-1]["id"],
+    })
+
+@router.post("/post_temp_hum/binary", dependencies=[Depends(RateLimiter(times=100, seconds=60))])
+async def post_temp_hum_binary(request: Request):
+    # 以 HMAC 簽章的二進位封包上傳 (格式見 src/utils/sensorwire.py)，成功時不回傳內容以減少傳輸量
+    try:
+        await ingest_frame(await request.body())
+    except FrameError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    return Response(status_code=204)
+
 @router.get("/get_temp_hum", dependencies=[Depends(RateLimiter(times=120, seconds=60))])
-async def get_temp_hum(key: str, sensor_id: Union[int, None] = None, item_id: Union[int, None] = None):
-    if not verify_api_key(key):
-        raise HTTPException(status_code=401, detail="Invalid API Key")
-    if not permission_check(key, "get_temp_hum"):
-        raise HTTPException(status_code=403, detail="Insufficient permissions")
+async def get_temp_hum(
+    key: str,
+    sensor_id: Union[int, None] = None,
+    item_id: Union[int, None] = None,
+    start: Optional[int] = Query(None, alias="from", description="Unix timestamp, defaults to 24 hours before `to`"),
+    end: Optional[int] = Query(None, alias="to", description="Unix timestamp, defaults to now"),
+    bucket: Optional[int] = Query(None, ge=60, description=f"Bucket size in seconds, sized automatically when omitted; returns min/max/avg per bucket, at most {MAX_POINTS} points (use /get_temp_hum/export for raw readings)"),
+):
+    await check_api_key(key, "get_temp_hum")
 
-    with open('db.json', 'r') as file:
-        db_data = json.load(file)
+    if start is not None or end is not None or bucket is not None:
+        # 時間範圍查詢，只讀取 (sensor, ts) 索引中對應的區段
+        if sensor_id is None or item_id is not None:
+            raise HTTPException(status_code=422, detail="from/to/bucket require sensor_id and cannot be combined with item_id")
+        sensor_key = f"sensor_{sensor_id}"
+        if not sensor_exists(sensor_key):
+            raise HTTPException(status_code=404, detail="Sensor not found")
+        end = int(time.time()) if end is None else end
+        start = end - 86400 if start is None else start
+        if start > end:
+            raise HTTPException(status_code=422, detail="from must not be later than to")
+        # 回傳的點數有上限，原始資料改由 /get_temp_hum/export 分段串流
+        if bucket is not None and bucket_count(start, end, bucket) > MAX_POINTS:
+            raise HTTPException(status_code=422, detail=f"bucket is too small for this range, at most {MAX_POINTS} points are returned")
+        return JSONResponse(content=query_aggregate(sensor_key, start, end, bucket), status_code=200)
 
     if sensor_id is not None:
         # 如果提供了 sensor_id
         sensor_key = f"sensor_{sensor_id}"
-        if sensor_key not in db_data:
+        if not sensor_exists(sensor_key):
             raise HTTPException(status_code=404, detail="Sensor not found")
 
         if item_id is not None:
             # 如果同時提供了 item_id
-            data = db_data.get(sensor_key, [])
-            for entry in data:
-                if entry.get("id") == item_id:
-                    return entry
+            entry = get_reading(sensor_key, item_id)
+            if entry is not None:
+                return entry
             raise HTTPException(status_code=404, detail="Item not found")
         else:
             # 如果只提供了 sensor_id，返回 sensor_id 下的所有數據
-            return JSONResponse(content=db_data.get(sensor_key, []), status_code=200)
+            return JSONResponse(content=get_readings(sensor_key), status_code=200)
     else:
         if item_id is not None:
             # 如果只提供了 item_id，變歷所有傳感器數據以尋找相應的項目
-            found_data = []
-            for sensor_key, sensor_data in db_data.items():
-                for data in sensor_data:
-                    if data.get("id") == item_id:
-                        found_data.append({sensor_key: data})
+            found_data = find_item(item_id)
             if found_data:
                 return JSONResponse(content=found_data, status_code=200)
             else:
                 raise HTTPException(status_code=404, detail="Item not found")
         else:
-            return JSONResponse(content=db_data, status_code=200)
+            return JSONResponse(content=get_all_readings(), status_code=200)
+
+def _export_rows(sensor: str, start: int, end: int, format: str, compress: bool):
+    # gzip 為 wbits=31 的 zlib 串流，每批資料壓縮後就送出
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    def emit(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    try:
+        if format == "csv":
+            yield emit("id,time,timestamp,temperature,humidity\n")
+        for rows in iter_readings(sensor, start, end):
+            if format == "csv":
+                chunk = "".join(f"{row[0]},{format_reading(row)['time']},{row[1]},{row[2]},{row[3]}\n" for row in rows)
+            else:
+                chunk = "".join(json.dumps({**format_reading(row), "timestamp": row[1]}) + "\n" for row in rows)
+            data = emit(chunk)
+            if data:
+                yield data
+    except Exception as e:
+        # 串流已開始，狀態碼無法再更改：重新拋出讓連線中斷，不送出 gzip 結尾，避免不完整的匯出看起來像是完整的
+        logging.error(f"Error exporting {sensor} readings: {str(e)}")
+        raise
+    if compressor:
+        yield compressor.flush()
+
+@router.get("/get_temp_hum/export", dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+async def export_temp_hum(
+    key: str,
+    sensor_id: int,
+    start: Optional[int] = Query(None, alias="from", description="Unix timestamp, defaults to the first reading"),
+    end: Optional[int] = Query(None, alias="to", description="Unix timestamp, defaults to now"),
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = Query(False, description="Compress the export as a .gz file"),
+):
+    await check_api_key(key, "get_temp_hum")
+
+    sensor_key = f"sensor_{sensor_id}"
+    if not sensor_exists(sensor_key):
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    start = 0 if start is None else start
+    end = int(time.time()) if end is None else end
+
+    # 逐批讀取並輸出，記憶體用量與匯出的時間範圍無關
+    filename = f"{sensor_key}_{start}_{end}.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        _export_rows(sensor_key, start, end, format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+def sse_event(event: str, data: dict, event_id: str = None) -> str:
+    return (f"id: {event_id}\n" if event_id else "") + f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/get_temp_hum/subscribe", dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+async def subscribe_temp_hum(
+    request: Request,
+    key: str,
+    sensor_id: Optional[List[int]] = Query(None, description="Sensors to follow, all sensors when omitted"),
+):
+    await check_api_key(key, "get_temp_hum")
+    if len(broker) >= MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many subscribers")
+
+    sensors = [f"sensor_{sensor}" for sensor in sensor_id] if sensor_id else None
+
+    # Server-Sent Events：新資料寫入時由 broker 推送，取代輪詢 /get_temp_hum
+    async def stream():
+        # 在串流內訂閱，確保串流結束時一定會取消訂閱
+        subscription = broker.subscribe(sensors)
+        try:
+            yield "retry: 5000\n\n"
+            reported = 0
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    # 心跳同時用來偵測已中斷的連線
+                    if await request.is_disconnected():
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                if subscription.dropped != reported:
+                    # 連線太慢時較舊的資料會被丟棄，通知客戶端需要時改用 /get_temp_hum 補齊
+                    yield sse_event("dropped", {"count": subscription.dropped - reported})
+                    reported = subscription.dropped
+                yield sse_event("reading", event, f"{event['sensor']}:{event['id']}")
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # 避免 nginx 緩衝事件
+    })
@@ -1,5 +1,6 @@
-from fastapi import Response
+from fastapi import HTTPException, Response
 from src.database.mariadb import query_in_mariadb, get_mariadb_connect
+from typing import Optional
 import logging, secrets, time
 
 def verify_api_key(api_key: str) -> bool:
@@ -21,6 +22,28 @@ def permission_check(api_key: str, required_permission: str) -> bool:
     else:
         return False
 
+async def get_api_key(api_key: str) -> Optional[dict]:
+    conn, cursor = await get_mariadb_connect()
+    try:
+        cursor.execute("SELECT api_key, permissions, description FROM api_keys WHERE api_key = %s", (api_key,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+def has_permission(row: dict, required_permission: str) -> bool:
+    permissions = (row["permissions"] or "").split(",")
+    return "global" in permissions or required_permission in permissions
+
+async def check_api_key(api_key: str, required_permission: str) -> dict:
+    """驗證 API Key 與權限，失敗時拋出 401 / 403；成功時回傳 api_keys 的資料列"""
+    row = await get_api_key(api_key)
+    if row is None:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+    if not has_permission(row, required_permission):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    return row
+
 async def setCookie(response: Response, userId: int, loginType: str = "local", cookieName: str = "auth", maxAge: int = 300) -> str:
     conn, cursor = await get_mariadb_connect()
     sessionId = secrets.token_urlsafe(32)
@@ -1,8 +1,11 @@
 from src.database.mariadb import get_mariadb_connect
-import asyncio, time, logging
+from src.utils.imgcatalog import refresh_event, refresh_image_catalogs
+from src.utils.mcwatch import watchlist, poll_watchlist_task
+from src.utils.rconpool import rcon_pool_eviction_task
+import asyncio, time, logging, os
 
 stop_event = asyncio.Event()
-_task = None  # 背景任務的 reference
+_tasks = []  # 背景任務的 reference
 
 async def delete_expired_sessions():
     logging.info("Starting expired sessions cleanup task...")
@@ -16,7 +19,7 @@ async def delete_expired_sessions():
                 logging.info("Expired sessions cleaned successfully.")
             except Exception as e:
                 logging.error(f"Error during expired sessions cleanup: {e}")
-            
+
             # 可中斷的 sleep（最長 3 天，但 stop_event 被 set 時會提前醒來）
             try:
                 await asyncio.wait_for(stop_event.wait(), timeout=3 * 24 * 60 * 60)
@@ -25,18 +28,41 @@ async def delete_expired_sessions():
     except asyncio.CancelledError:
         logging.info("Expired session task cancelled gracefully.")
 
+async def refresh_image_catalog_task():
+    logging.info("Starting image catalog refresh task...")
+    interval = int(os.getenv("IMG_CATALOG_REFRESH_INTERVAL", 300))
+    try:
+        while not stop_event.is_set():
+            # 等待定時刷新、手動觸發 (refresh_event) 或停止訊號
+            stop_wait = asyncio.create_task(stop_event.wait())
+            refresh_wait = asyncio.create_task(refresh_event.wait())
+            try:
+                await asyncio.wait({stop_wait, refresh_wait}, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop_wait.cancel()
+                refresh_wait.cancel()
+            if stop_event.is_set():
+                break
+            refresh_event.clear()
+            await refresh_image_catalogs()
+    except asyncio.CancelledError:
+        logging.info("Image catalog refresh task cancelled gracefully.")
+
 async def start_background_tasks():
-    global _task
     stop_event.clear()
-    _task = asyncio.create_task(delete_expired_sessions())
+    _tasks.append(asyncio.create_task(delete_expired_sessions()))
+    _tasks.append(asyncio.create_task(refresh_image_catalog_task()))
+    _tasks.append(asyncio.create_task(rcon_pool_eviction_task(stop_event)))
+    if watchlist:
+        _tasks.append(asyncio.create_task(poll_watchlist_task(stop_event)))
     logging.info("Background task startup completed")
 
 async def stop_background_tasks():
-    global _task
     logging.info("Stopping background tasks...")
     stop_event.set()
-    if _task:
+    while _tasks:
+        task = _tasks.pop()
         try:
-            await _task
+            await task
         except asyncio.CancelledError:
             logging.info("Background task canceled successfully.")
@@ -0,0 +1,236 @@
+from src.database.mariadb import get_mariadb_connect
+import asyncio, hashlib, logging, random
+
+IMAGE_TABLES = ("image", "image_phone")
+TAG_COMBO_CACHE_SIZE = 256  # 多標籤組合結果最多快取幾組
+
+refresh_event = asyncio.Event()  # 被 set 時背景任務會立即刷新圖片目錄
+
+
+class IdSet:
+    """可 O(1) 新增、刪除與均勻隨機抽取的 id 集合"""
+
+    __slots__ = ("items", "positions")
+
+    def __init__(self):
+        self.items = []       # 實際存放 id 的陣列，用於隨機抽取
+        self.positions = {}   # id -> 在 items 中的索引
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, image_id):
+        return image_id in self.positions
+
+    def add(self, image_id):
+        if image_id in self.positions:
+            return
+        self.positions[image_id] = len(self.items)
+        self.items.append(image_id)
+
+    def discard(self, image_id):
+        index = self.positions.pop(image_id, None)
+        if index is None:
+            return
+        # 將最後一個元素搬到被刪除的位置，避免 O(n) 的 list.remove
+        last = self.items.pop()
+        if index < len(self.items):
+            self.items[index] = last
+            self.positions[last] = index
+
+    def choice(self):
+        return random.choice(self.items) if self.items else None
+
+
+def parse_tags(tags) -> list:
+    """將逗號分隔的標籤字串轉為正規化後的標籤清單"""
+    if not tags:
+        return []
+    return [tag.strip().lower() for tag in tags.split(",") if tag.strip()]
+
+
+def _row_hash(row: dict) -> int:
+    data = repr((row["id"], row["fileName"], row["size"], row["tags"], row["updateAt"], row["origin"])).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class ImageCatalog:
+    """將單一圖片資料表載入記憶體，讓隨機抽圖不需要查詢資料庫"""
+
+    def __init__(self, table: str):
+        self.table = table
+        self.rows = {}          # id -> 已轉換好的圖片資料
+        self.ids = IdSet()
+        self.tags = {}          # 標籤 -> IdSet (反向索引)
+        self._combos = {}       # (模式, 標籤組合) -> 符合的 id 清單
+        self.last_update = None  # 目前看過最新的 updateAt (datetime)
+        self.max_id = 0
+        self.content_hash = 0    # 各筆資料雜湊值的總和 (mod 2^64)，與順序無關且可增量更新
+        self.version = None      # 目錄版本，內容變動時才會改變，用於 ETag 與快取
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _index_tags(self, image_id, old_tags, new_tags):
+        for tag in set(parse_tags(old_tags)) - set(parse_tags(new_tags)):
+            tag_ids = self.tags.get(tag)
+            if tag_ids is not None:
+                tag_ids.discard(image_id)
+                if not tag_ids:
+                    del self.tags[tag]
+        for tag in parse_tags(new_tags):
+            self.tags.setdefault(tag, IdSet()).add(image_id)
+
+    def _apply(self, image) -> bool:
+        """寫入一筆圖片資料，回傳內容是否有變動"""
+        image_id = image["id"]
+        row = {
+            "id": image_id,
+            "fileName": image["fileName"],
+            "size": float(image["size"]),
+            "tags": image["tags"],
+            "updateAt": int(image["updateAt"].timestamp()) if image["updateAt"] else None,
+            "origin": image["origin"],
+        }
+        old = self.rows.get(image_id)
+        if old == row:
+            return False
+        self._index_tags(image_id, old["tags"] if old else None, image["tags"])
+        self.rows[image_id] = row
+        if old is None:
+            self.ids.add(image_id)
+        else:
+            self.content_hash -= _row_hash(old)
+        self.content_hash = (self.content_hash + _row_hash(row)) % 2 ** 64
+        self.max_id = max(self.max_id, image_id)
+        if image["updateAt"] and (self.last_update is None or image["updateAt"] > self.last_update):
+            self.last_update = image["updateAt"]
+        return True
+
+    def _remove(self, image_id):
+        old = self.rows.pop(image_id, None)
+        if old:
+            self._index_tags(image_id, old["tags"], None)
+            self.content_hash = (self.content_hash - _row_hash(old)) % 2 ** 64
+        self.ids.discard(image_id)
+
+    def _update_version(self):
+        # 由全部資料內容算出，任何一筆的任何欄位變動都會改變版本，且各 worker 之間一致
+        raw = f"{self.table}:{len(self)}:{self.content_hash}"
+        self.version = hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+    async def load(self):
+        conn, cursor = await get_mariadb_connect()
+        try:
+            cursor.execute(f"SELECT * FROM {self.table}")
+            self.rows = {}
+            self.ids = IdSet()
+            self.tags = {}
+            self._combos = {}
+            self.last_update = None
+            self.max_id = 0
+            self.content_hash = 0
+            for image in cursor.fetchall():
+                self._apply(image)
+            self._update_version()
+            self.loaded = True
+            logging.info(f"Image catalog '{self.table}' loaded with {len(self)} images.")
+        finally:
+            cursor.close()
+            conn.close()
+
+    async def refresh(self) -> bool:
+        """增量刷新，回傳目錄內容是否有變動"""
+        if not self.loaded:
+            await self.load()
+            return True
+
+        conn, cursor = await get_mariadb_connect()
+        try:
+            # 只抓新增或更新過的資料 (>= 避免漏掉同一秒內更新的資料)
+            cursor.execute(
+                f"SELECT * FROM {self.table} WHERE id > %s OR updateAt >= %s",
+                (self.max_id, self.last_update or 0),
+            )
+            changed = sum(self._apply(image) for image in cursor.fetchall())
+
+            # 筆數對不上代表有資料被刪除，再比對 id 清單
+            cursor.execute(f"SELECT COUNT(*) AS total FROM {self.table}")
+            removed = 0
+            if cursor.fetchone()["total"] != len(self):
+                cursor.execute(f"SELECT id FROM {self.table}")
+                existing = {row["id"] for row in cursor.fetchall()}
+                for image_id in [i for i in self.rows if i not in existing]:
+                    self._remove(image_id)
+                    removed += 1
+
+            if changed or removed:
+                self._combos = {}
+                self._update_version()
+                logging.info(f"Image catalog '{self.table}' refreshed: {changed} upserted, {removed} removed.")
+            return bool(changed or removed)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _candidates(self, tags: list, match_all: bool) -> list:
+        """回傳可隨機抽取的 id 清單；多標籤組合計算一次後快取到目錄變動為止"""
+        if not tags:
+            return self.ids.items
+        if len(tags) == 1:
+            return self.tags[tags[0]].items if tags[0] in self.tags else []
+
+        key = (match_all, frozenset(tags))
+        combo = self._combos.get(key)
+        if combo is None:
+            tag_sets = [self.tags.get(tag, IdSet()) for tag in key[1]]
+            if match_all:
+                # 從最小的集合開始比對，成本只與最小集合大小有關
+                tag_sets.sort(key=len)
+                combo = [i for i in tag_sets[0].items if all(i in other for other in tag_sets[1:])]
+            else:
+                combo = list({i for tag_ids in tag_sets for i in tag_ids.items})
+            if len(self._combos) >= TAG_COMBO_CACHE_SIZE:
+                self._combos.pop(next(iter(self._combos)))
+            self._combos[key] = combo
+        return combo
+
+    def random_image(self, tags: list = None, match_all: bool = False):
+        candidates = self._candidates(tags or [], match_all)
+        return self.rows[random.choice(candidates)] if candidates else None
+
+    def sample(self, n: int, tags: list = None, match_all: bool = False) -> list:
+        """不重複地隨機抽取最多 n 張圖片"""
+        candidates = self._candidates(tags or [], match_all)
+        return [self.rows[i] for i in random.sample(candidates, min(n, len(candidates)))]
+
+    def get(self, image_id: int):
+        return self.rows.get(image_id)
+
+
+catalogs = {table: ImageCatalog(table) for table in IMAGE_TABLES}
+
+
+def get_catalog(table: str) -> ImageCatalog:
+    return catalogs[table]
+
+
+async def load_image_catalogs():
+    for catalog in catalogs.values():
+        try:
+            await catalog.load()
+        except Exception as e:
+            logging.error(f"Unable to load image catalog '{catalog.table}': {e}")
+
+
+async def refresh_image_catalogs():
+    for catalog in catalogs.values():
+        try:
+            await catalog.refresh()
+        except Exception as e:
+            logging.error(f"Unable to refresh image catalog '{catalog.table}': {e}")
+
+
+def request_catalog_refresh():
+    refresh_event.set()
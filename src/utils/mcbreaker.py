@@ -0,0 +1,75 @@
+import os, time
+
+BREAKER_THRESHOLD = int(os.getenv("MC_BREAKER_THRESHOLD", 2))          # 連續失敗幾次後開始熔斷
+BREAKER_BASE_DELAY = float(os.getenv("MC_BREAKER_BASE_DELAY", 5))      # 第一次熔斷的秒數，之後每次加倍
+BREAKER_MAX_DELAY = float(os.getenv("MC_BREAKER_MAX_DELAY", 300))      # 熔斷秒數上限
+BREAKER_TRIAL_WINDOW = float(os.getenv("MC_BREAKER_TRIAL_WINDOW", 15))  # 半開狀態下試探請求的保留時間
+
+
+class TargetState:
+    __slots__ = ("failures", "open_until", "last_failure", "last_error")
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.last_failure = 0.0
+        self.last_error = None
+
+
+class CircuitBreaker:
+    """依目標記錄連續失敗次數，失敗過多時在退避期間內直接拒絕探測"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._states = {}  # (edition, host, port) -> TargetState
+
+    def allow(self, key) -> bool:
+        state = self._states.get(key)
+        if state is None or state.failures < BREAKER_THRESHOLD:
+            return True
+        now = time.time()
+        if now < state.open_until:
+            return False
+        # 半開：放行這一個試探請求，其他請求在試探期間仍直接拒絕
+        state.open_until = now + BREAKER_TRIAL_WINDOW
+        return True
+
+    def record_success(self, key):
+        self._states.pop(key, None)
+
+    def record_failure(self, key, error: Exception):
+        state = self._states.get(key)
+        if state is None:
+            if len(self._states) >= self.max_entries:
+                self._states.pop(next(iter(self._states)))
+            state = self._states[key] = TargetState()
+        now = time.time()
+        state.failures += 1
+        state.last_failure = now
+        state.last_error = repr(error)
+        if state.failures >= BREAKER_THRESHOLD:
+            delay = min(BREAKER_MAX_DELAY, BREAKER_BASE_DELAY * 2 ** (state.failures - BREAKER_THRESHOLD))
+            state.open_until = now + delay
+
+    def last_failure_age(self, key) -> float:
+        state = self._states.get(key)
+        return time.time() - state.last_failure if state else 0.0
+
+    def snapshot(self) -> list:
+        now = time.time()
+        return [
+            {
+                "edition": key[0],
+                "host": key[1],
+                "port": key[2],
+                "state": "closed" if state.failures < BREAKER_THRESHOLD else ("open" if now < state.open_until else "half-open"),
+                "failures": state.failures,
+                "retryIn": round(max(0.0, state.open_until - now), 2),
+                "lastFailure": int(state.last_failure),
+                "lastError": state.last_error,
+            }
+            for key, state in self._states.items()
+        ]
+
+
+breaker = CircuitBreaker()
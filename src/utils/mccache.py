@@ -0,0 +1,59 @@
+from collections import OrderedDict
+import asyncio, time
+
+
+class TTLCache:
+    """有 TTL 與容量上限的快取，同一個 key 同時未命中時只會執行一次取值"""
+
+    def __init__(self, ttl: float, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (寫入時間, TTL, 值)
+        self._inflight = {}            # key -> 正在執行的取值 task
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """回傳 (值, 已存在秒數)，沒有或已過期時回傳 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry[0]
+        if age >= entry[1]:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[2], age
+
+    def set(self, key, value, ttl: float = None):
+        self._entries[key] = (time.monotonic(), self.ttl if ttl is None else ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, key, factory, ttl_of):
+        try:
+            value = await factory()
+            self.set(key, value, ttl_of(value) if ttl_of else None)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_fetch(self, key, factory, ttl_of=None):
+        """回傳 (值, 是否來自快取, 已存在秒數)；factory 為回傳 coroutine 的函式，ttl_of 可依取得的值決定 TTL"""
+        hit = self.get(key)
+        if hit is not None:
+            self.hits += 1
+            return hit[0], True, hit[1]
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, factory, ttl_of))
+            self._inflight[key] = task
+        # shield: 單一請求被取消時不影響其他正在等待同一個結果的請求
+        value = await asyncio.shield(task)
+        return value, False, 0.0
@@ -0,0 +1,81 @@
+from src.utils.mccache import TTLCache
+import dns.asyncresolver, dns.exception, dns.resolver
+import ipaddress, os
+
+DNS_TIMEOUT = float(os.getenv("MC_DNS_TIMEOUT", 3))             # 單次 DNS 查詢的最長秒數
+DNS_NEGATIVE_TTL = float(os.getenv("MC_DNS_NEGATIVE_TTL", 30))  # NXDOMAIN / 無紀錄結果的快取秒數
+DNS_MIN_TTL = 5
+DNS_MAX_TTL = 3600
+
+_resolver = dns.asyncresolver.Resolver()
+
+# (名稱, 紀錄類型) -> (結果或 None, TTL)
+dns_cache = TTLCache(ttl=DNS_NEGATIVE_TTL, max_entries=int(os.getenv("MC_DNS_CACHE_SIZE", 4096)))
+negative_hits = 0
+
+
+class DNSResolutionError(Exception):
+    pass
+
+
+async def _query(name: str, rdtype: str) -> tuple:
+    try:
+        answer = await _resolver.resolve(name, rdtype, lifetime=DNS_TIMEOUT)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return None, DNS_NEGATIVE_TTL
+    ttl = min(DNS_MAX_TTL, max(DNS_MIN_TTL, answer.rrset.ttl))
+    if rdtype == "SRV":
+        # 取優先度最高 (數字最小)、權重最大的紀錄
+        record = min(answer, key=lambda r: (r.priority, -r.weight))
+        return (str(record.target).rstrip("."), record.port), ttl
+    return [record.address for record in answer], ttl
+
+
+async def resolve(name: str, rdtype: str):
+    """查詢並依紀錄 TTL 快取結果，同一名稱同時查詢時只會送出一次；查無紀錄時回傳 None"""
+    global negative_hits
+    key = (name.lower().rstrip("."), rdtype)
+    (value, _), cached, _ = await dns_cache.get_or_fetch(key, lambda: _query(key[0], rdtype), ttl_of=lambda result: result[1])
+    if cached and value is None:
+        negative_hits += 1
+    return value
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+async def resolve_java(host: str, port: int) -> tuple:
+    """與 JavaServer.lookup 相同：只有使用預設埠時才查詢 _minecraft._tcp SRV 紀錄"""
+    if port != 25565 or _is_ip(host):
+        return host, port
+    try:
+        srv = await resolve(f"_minecraft._tcp.{host}", "SRV")
+    except dns.exception.DNSException:
+        srv = None
+    return srv or (host, port)
+
+
+async def resolve_address(host: str) -> str:
+    if _is_ip(host):
+        return host
+    try:
+        addresses = await resolve(host, "A")
+    except dns.exception.DNSException as e:
+        raise DNSResolutionError(f"Unable to resolve {host}: {e!r}")
+    if not addresses:
+        raise DNSResolutionError(f"No A record for {host}")
+    return addresses[0]
+
+
+def dns_stats() -> dict:
+    return {
+        "entries": len(dns_cache),
+        "hits": dns_cache.hits,
+        "misses": dns_cache.misses,
+        "negativeHits": negative_hits,
+    }
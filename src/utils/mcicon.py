@@ -0,0 +1,35 @@
+from collections import OrderedDict
+from typing import Optional
+import base64, binascii, hashlib, logging, os
+
+ICON_URL_PREFIX = os.getenv("MC_ICON_URL_PREFIX", "/api/minecraft/icon/")  # 回應中 icon 網址的前綴
+ICON_CACHE_SIZE = int(os.getenv("MC_ICON_CACHE_SIZE", 1024))               # 最多保留幾個圖示
+
+_icons = OrderedDict()  # sha256 -> PNG bytes
+
+
+def store_icon(favicon: Optional[str]) -> Optional[str]:
+    """將 data URI 形式的伺服器圖示存起來，回傳以內容雜湊命名的網址"""
+    if not favicon:
+        return None
+    try:
+        # 格式為 "data:image/png;base64,...."，部分伺服器的 base64 內含換行
+        data = favicon.partition(",")[2] if favicon.startswith("data:") else favicon
+        png = base64.b64decode("".join(data.split()), validate=True)
+    except (binascii.Error, ValueError) as e:
+        logging.warning(f"Invalid server favicon: {e!r}")
+        return None
+
+    digest = hashlib.sha256(png).hexdigest()
+    _icons[digest] = png
+    _icons.move_to_end(digest)
+    while len(_icons) > ICON_CACHE_SIZE:
+        _icons.popitem(last=False)
+    return f"{ICON_URL_PREFIX}{digest}.png"
+
+
+def get_icon(digest: str) -> Optional[bytes]:
+    png = _icons.get(digest)
+    if png is not None:
+        _icons.move_to_end(digest)
+    return png
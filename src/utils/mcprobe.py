@@ -0,0 +1,248 @@
+from concurrent.futures import ThreadPoolExecutor
+from mcstatus import JavaServer, BedrockServer
+from mcclient import SLPClient, QueryClient
+from src.utils.mccache import TTLCache
+from src.utils.mcbreaker import breaker
+from src.utils.mcicon import store_icon
+from src.utils.mcdns import resolve_java, resolve_address
+import asyncio, logging, os, time
+
+PROBE_TIMEOUT = float(os.getenv("MC_PROBE_TIMEOUT", 5))  # 單次探測的最長秒數
+STATUS_CACHE_TTL = float(os.getenv("MC_STATUS_CACHE_TTL", 30))  # 狀態快取秒數
+BULK_CONCURRENCY = int(os.getenv("MC_BULK_CONCURRENCY", 32))     # 批次查詢同時探測的數量
+BULK_TARGET_TIMEOUT = float(os.getenv("MC_BULK_TARGET_TIMEOUT", 10))  # 批次查詢中單一目標的最長秒數
+DEFAULT_PORTS = {"java": 25565, "bedrock": 19132}
+HEDGE_DELAY = float(os.getenv("MC_HEDGE_DELAY", 0.3))  # 主要後端多久沒回應就同時啟動備用後端，0 為直接競速
+
+# mcclient 只有同步 API，放在有上限的執行緒池中執行，避免卡住 event loop
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MC_PROBE_WORKERS", 16)), thread_name_prefix="mcprobe")
+
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(_executor, func, *args), timeout=PROBE_TIMEOUT)
+
+
+def offline_status(host: str, port: int, query_time: int) -> dict:
+    return {
+        "online": False,
+        "host": host,
+        "port": port,
+        "query_time": query_time
+    }
+
+
+async def probe_java_mcstatus(host: str, port: int) -> dict:
+    # SRV 與 A 紀錄使用共用的 DNS 快取；SLP 握手封包會帶主機名稱 (反向代理依此轉發)，所以狀態查詢仍使用主機名稱
+    target_host, target_port = await resolve_java(host, port)
+    server = JavaServer(target_host, target_port, timeout=PROBE_TIMEOUT)
+    status = await asyncio.wait_for(server.async_status(), timeout=PROBE_TIMEOUT)
+
+    # 嘗試查詢伺服器的更多信息
+    query = None
+    try:
+        query_server = JavaServer(await resolve_address(target_host), target_port, timeout=PROBE_TIMEOUT)
+        query = await asyncio.wait_for(query_server.async_query(), timeout=PROBE_TIMEOUT)
+    except Exception as query_exception:
+        logging.warning(f"Query failed: {query_exception!r}")
+        query = None  # 如果 query 失敗，將 query 設為 None
+
+    return {
+        "online": True,
+        "host": host,
+        "port": port,
+        "version": status.version.name,
+        "players": {
+            "online": status.players.online,
+            "max": status.players.max,
+            "list": [player.name for player in status.players.sample or []]
+        },
+        "motd": status.description,
+        "latency": round(status.latency, 2),
+        "icon": store_icon(getattr(status, "favicon", None)),
+        "plugins": query.software.plugins if query else [],
+        "mods": [],
+        "software": query.software.brand if query else None,
+    }
+
+
+def _mcclient_status(host: str, port: int):
+    return SLPClient(host, port).get_status()
+
+
+def _mcclient_query(host: str, port: int):
+    return QueryClient(host, port).get_status()
+
+
+async def probe_java_mcclient(host: str, port: int) -> dict:
+    # 嘗試建立 SLP 客戶端來獲取伺服器狀態
+    target_host, target_port = await resolve_java(host, port)
+    status = await run_blocking(_mcclient_status, target_host, target_port)
+
+    # 嘗試建立 Query 客戶端來獲取額外信息
+    query = None
+    try:
+        query = await run_blocking(_mcclient_query, await resolve_address(target_host), target_port)
+    except Exception as query_exception:
+        logging.warning(f"Query failed: {query_exception!r}")
+        query = None  # 如果 Query 失敗，將 query 設為 None
+
+    return {
+        "online": True,
+        "host": host,
+        "port": port,
+        "version": status.version.name,
+        "players": {
+            "online": status.players.online,
+            "max": status.players.max,
+            "list": status.players.list
+        },
+        "motd": status.motd,
+        "latency": None,
+        "icon": store_icon(getattr(status, "favicon", None)),
+        "plugins": query.plugins if query else [],
+        "mods": [],
+        "software": None,
+    }
+
+
+async def probe_bedrock(host: str, port: int) -> dict:
+    server = BedrockServer(await resolve_address(host), port, timeout=PROBE_TIMEOUT)
+    status = await asyncio.wait_for(server.async_status(), timeout=PROBE_TIMEOUT)
+    return {
+        "online": True,
+        "host": host,
+        "port": port,
+        "version": status.version.name,
+        "players": {
+            "online": status.players.online,
+            "max": status.players.max
+        },
+        "motd": status.description,
+        "latency": round(status.latency, 2),
+        "icon": store_icon(getattr(status, "favicon", None)),
+        "plugins": [],
+        "mods": [],
+        "software": None,
+    }
+
+
+# 各後端在 hedged 模式中勝出的次數
+hedge_wins = {"mcstatus": 0, "mcclient": 0}
+
+
+async def probe_java_hedged(host: str, port: int) -> dict:
+    """先以 mcstatus 探測，逾 HEDGE_DELAY 未完成或失敗時同時以 mcclient 探測，採用最先成功的結果"""
+    pending = {asyncio.ensure_future(probe_java_mcstatus(host, port)): "mcstatus"}
+    backups = [("mcclient", probe_java_mcclient)]
+    error = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=HEDGE_DELAY if backups else None, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                backend = pending.pop(task)
+                if task.exception() is None:
+                    hedge_wins[backend] += 1
+                    return {**task.result(), "backend": backend}
+                error = task.exception()
+            # 走到這裡代表逾時或有後端失敗，啟動下一個備用後端
+            if backups:
+                backend, probe = backups.pop(0)
+                pending[asyncio.ensure_future(probe(host, port))] = backend
+        raise error
+    finally:
+        # 取消落後的後端 (mcclient 在執行緒池中的呼叫會自行逾時結束)
+        for task in pending:
+            task.cancel()
+
+
+PROBES = {
+    ("java", "mcstatus"): probe_java_mcstatus,
+    ("java", "mcclient"): probe_java_mcclient,
+    ("java", "hedged"): probe_java_hedged,
+    ("bedrock", "mcstatus"): probe_bedrock,
+}
+
+# (edition, host, port, backend) -> 探測結果
+status_cache = TTLCache(ttl=STATUS_CACHE_TTL, max_entries=int(os.getenv("MC_STATUS_CACHE_SIZE", 4096)))
+
+# 由 watchlist 輪詢填入: (edition, host, port) -> (取樣時間, 有效期限, 狀態或 None)
+watched_status = {}
+
+
+class ServerOffline(Exception):
+    """不需實際探測就已知伺服器離線 (watchlist 取樣或熔斷中)"""
+
+    def __init__(self, message: str, age: float = 0.0):
+        super().__init__(message)
+        self.age = age
+
+
+async def probe_status(edition: str, host: str, port: int, backend: str = "mcstatus") -> tuple:
+    """回傳 (狀態, 是否來自快取, 已快取秒數)；同一目標同時查詢時共用一次探測"""
+    # watchlist 中的伺服器不論指定哪個後端都直接使用最近一次的取樣結果，不再另外探測
+    sample = watched_status.get((edition, host.lower(), port))
+    if sample and time.time() < sample[1]:
+        if sample[2] is None:
+            raise ServerOffline(f"{host}:{port} was offline at the last watchlist poll", time.time() - sample[0])
+        # 取樣使用 mcstatus，指定其他後端時以 backend 欄位標示資料來源
+        status = sample[2] if backend == "mcstatus" else {**sample[2], "backend": "mcstatus"}
+        return status, True, time.time() - sample[0]
+
+    # 最近連續失敗的目標在退避期間直接回報離線，不再等待 socket 逾時
+    target = (edition, host.lower(), port)
+    if not breaker.allow(target):
+        raise ServerOffline(f"{host}:{port} is unreachable, backing off", breaker.last_failure_age(target))
+
+    probe = PROBES[(edition, backend)]
+
+    async def fetch():
+        try:
+            status = await probe(host, port)
+        except Exception as e:
+            breaker.record_failure(target, e)
+            raise
+        breaker.record_success(target)
+        return status
+
+    return await status_cache.get_or_fetch((*target, backend), fetch)
+
+
+def status_content(status: dict, cached: bool, age: float) -> dict:
+    # query_time 為實際探測的時間，快取命中時會早於目前時間
+    return {
+        **status,
+        "query_time": int(time.time() - age),
+        "cached": cached,
+        "age": round(age, 2),
+    }
+
+
+def failure_content(error: Exception, host: str, port: int, query_time: int) -> dict:
+    if isinstance(error, ServerOffline):
+        return {**offline_status(host, port, int(query_time - error.age)), "cached": True, "age": round(error.age, 2)}
+    return offline_status(host, port, query_time)
+
+
+async def bulk_probe(targets: list):
+    """同時探測多個 (edition, host, port, backend) 目標，依完成順序逐一產生結果"""
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def run(index, edition, host, port, backend):
+        async with semaphore:
+            try:
+                status, cached, age = await asyncio.wait_for(probe_status(edition, host, port, backend), timeout=BULK_TARGET_TIMEOUT)
+                content = status_content(status, cached, age)
+            except Exception as e:
+                logging.warning(f"Bulk probe {edition} {host}:{port} failed: {e!r}")
+                content = failure_content(e, host, port, int(time.time()))
+            return {"index": index, "edition": edition, **content}
+
+    tasks = [asyncio.ensure_future(run(index, *target)) for index, target in enumerate(targets)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 用戶端中途斷線時取消尚未完成的探測
+        for task in tasks:
+            task.cancel()
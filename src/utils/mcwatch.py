@@ -0,0 +1,143 @@
+from src.utils.mcprobe import PROBES, DEFAULT_PORTS, PROBE_TIMEOUT, watched_status
+import asyncio, logging, os, sqlite3, time
+
+HISTORY_DB = "mc_history.db"
+WATCH_INTERVAL = int(os.getenv("MC_WATCH_INTERVAL", 60))               # 輪詢間隔 (秒)
+HISTORY_RETENTION = int(os.getenv("MC_HISTORY_RETENTION_DAYS", 30)) * 86400
+MAX_POINTS = 500  # 未指定 bucket 時，自動挑選讓回傳點數不超過此數的 bucket 大小
+
+
+def parse_watchlist(value: str) -> list:
+    # 格式: "java:play.example.com:25565,bedrock:pe.example.com"，埠可省略
+    targets = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        parts = item.split(":")
+        if len(parts) not in (2, 3) or parts[0] not in DEFAULT_PORTS:
+            logging.warning(f"Ignoring invalid watchlist entry: {item}")
+            continue
+        port = int(parts[2]) if len(parts) == 3 else DEFAULT_PORTS[parts[0]]
+        targets.append((parts[0], parts[1].lower(), port))
+    return targets
+
+
+watchlist = parse_watchlist(os.getenv("MC_WATCHLIST", ""))
+
+
+def target_key(edition: str, host: str, port: int) -> str:
+    return f"{edition}:{host.lower()}:{port}"
+
+
+def is_watched(edition: str, host: str, port: int) -> bool:
+    return (edition, host.lower(), port) in watchlist
+
+
+def create_history_db():
+    conn = sqlite3.connect(HISTORY_DB)
+    # (target, ts) 為主鍵且不使用 rowid，資料依目標與時間排列，範圍查詢只需掃描需要的區段
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS samples (
+        target TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        online INTEGER NOT NULL,
+        players INTEGER,
+        latency REAL,
+        PRIMARY KEY (target, ts)
+    ) WITHOUT ROWID''')
+    conn.commit()
+    conn.close()
+
+
+def store_samples(samples: list, prune_before: int = None):
+    conn = sqlite3.connect(HISTORY_DB)
+    try:
+        conn.executemany("INSERT OR REPLACE INTO samples (target, ts, online, players, latency) VALUES (?, ?, ?, ?, ?)", samples)
+        if prune_before is not None:
+            conn.execute("DELETE FROM samples WHERE ts < ?", (prune_before,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def query_history(edition: str, host: str, port: int, start: int, end: int, bucket: int = None) -> dict:
+    if bucket is None:
+        bucket = max(WATCH_INTERVAL, -(-(end - start) // MAX_POINTS))
+    conn = sqlite3.connect(HISTORY_DB)
+    try:
+        rows = conn.execute('''
+            SELECT (ts / ?) * ? AS bucket_start, COUNT(*), AVG(online),
+                   MIN(players), MAX(players), AVG(players), AVG(latency), MAX(latency)
+            FROM samples
+            WHERE target = ? AND ts >= ? AND ts <= ?
+            GROUP BY bucket_start
+            ORDER BY bucket_start
+        ''', (bucket, bucket, target_key(edition, host, port), start, end)).fetchall()
+    finally:
+        conn.close()
+
+    total = sum(row[1] for row in rows)
+    return {
+        "edition": edition,
+        "host": host,
+        "port": port,
+        "from": start,
+        "to": end,
+        "bucket": bucket,
+        "uptime": round(sum(row[1] * row[2] for row in rows) / total, 4) if total else None,
+        "points": [
+            {
+                "time": row[0],
+                "samples": row[1],
+                "uptime": round(row[2], 4),
+                "players": {"min": row[3], "max": row[4], "avg": round(row[5], 2) if row[5] is not None else None},
+                "latency": {"avg": round(row[6], 2) if row[6] is not None else None, "max": row[7]},
+            }
+            for row in rows
+        ],
+    }
+
+
+async def _sample(edition: str, host: str, port: int):
+    try:
+        status = await asyncio.wait_for(PROBES[(edition, "mcstatus")](host, port), timeout=PROBE_TIMEOUT * 2)
+    except Exception as e:
+        logging.warning(f"Watchlist probe {edition} {host}:{port} failed: {e!r}")
+        status = None
+    return (edition, host, port), status
+
+
+async def poll_watchlist(prune: bool = False):
+    now = int(time.time())
+    samples = []
+    for target, status in await asyncio.gather(*(_sample(*target) for target in watchlist)):
+        # 提供給狀態查詢使用，兩個間隔內都視為有效
+        watched_status[target] = (now, now + WATCH_INTERVAL * 2, status)
+        samples.append((
+            target_key(*target),
+            now,
+            1 if status else 0,
+            status["players"]["online"] if status else None,
+            status["latency"] if status else None,
+        ))
+    store_samples(samples, prune_before=now - HISTORY_RETENTION if prune else None)
+
+
+async def poll_watchlist_task(stop_event: asyncio.Event):
+    logging.info(f"Starting Minecraft watchlist poller for {len(watchlist)} servers...")
+    create_history_db()
+    last_prune = 0
+    try:
+        while not stop_event.is_set():
+            try:
+                prune = time.time() - last_prune >= 3600
+                await poll_watchlist(prune=prune)
+                if prune:
+                    last_prune = time.time()
+            except Exception as e:
+                logging.error(f"Error during Minecraft watchlist poll: {e}")
+
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=WATCH_INTERVAL)
+            except asyncio.TimeoutError:
+                continue
+    except asyncio.CancelledError:
+        logging.info("Minecraft watchlist poller cancelled gracefully.")
@@ -0,0 +1,153 @@
+from contextlib import asynccontextmanager
+import aiomcrcon
+import asyncio, hashlib, logging, os, time
+
+RCON_TIMEOUT = float(os.getenv("MC_RCON_TIMEOUT", 5))            # 連線與單一指令的最長秒數
+RCON_IDLE_TIMEOUT = float(os.getenv("MC_RCON_IDLE_TIMEOUT", 300))  # 閒置多久後關閉連線
+RCON_POOL_SIZE = int(os.getenv("MC_RCON_POOL_SIZE", 64))          # 最多保留的連線數
+
+
+class PooledRconClient:
+    """已驗證的 RCON 連線，搭配 lock 確保同一連線上的指令依序執行"""
+
+    def __init__(self, host: str, port: int, password: str):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.client = None
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        # 不送出指令的健康檢查：底層 stream 已關閉或讀到 EOF 就視為斷線
+        if self.client is None:
+            return False
+        writer = getattr(self.client, "_writer", None)
+        reader = getattr(self.client, "_reader", None)
+        if writer is not None and writer.is_closing():
+            return False
+        if reader is not None and reader.at_eof():
+            return False
+        return True
+
+    async def connect(self):
+        client = aiomcrcon.Client(host=self.host, port=self.port, password=self.password)
+        try:
+            await asyncio.wait_for(client.connect(), timeout=RCON_TIMEOUT)
+        except BaseException:
+            await self._close_client(client)
+            raise
+        self.client = client
+
+    async def close(self):
+        client, self.client = self.client, None
+        if client is not None:
+            await self._close_client(client)
+
+    @staticmethod
+    async def _close_client(client):
+        try:
+            await client.close()
+        except Exception as e:
+            logging.debug(f"Error closing RCON client: {e!r}")
+
+    async def send(self, cmd: str):
+        """呼叫前需先取得 lock"""
+        # 已被伺服器關閉的連線在送出指令前就換掉，這是唯一可以安全重新連線的時機
+        if not self.is_alive():
+            await self.close()
+        if self.client is None:
+            await self.connect()
+        try:
+            return await asyncio.wait_for(self.client.send_cmd(cmd), timeout=RCON_TIMEOUT)
+        except aiomcrcon.ClientNotConnectedError:
+            # 指令尚未寫出，重新連線後再送一次不會重複執行
+            await self.close()
+            await self.connect()
+            return await self._send_once(cmd)
+        except BaseException:
+            # 指令可能已送達並執行 (例如讀取回應時斷線)，不自動重送以免 give / ban 這類指令執行兩次；
+            # 連線狀態不明，不再重複使用
+            await self.close()
+            raise
+        finally:
+            self.last_used = time.monotonic()
+
+    async def _send_once(self, cmd: str):
+        try:
+            return await asyncio.wait_for(self.client.send_cmd(cmd), timeout=RCON_TIMEOUT)
+        except BaseException:
+            await self.close()
+            raise
+
+
+class RconPool:
+    def __init__(self):
+        self._clients = {}  # (host, port, 密碼雜湊) -> PooledRconClient
+
+    def __len__(self):
+        return len(self._clients)
+
+    @staticmethod
+    def _key(host: str, port: int, password: str) -> tuple:
+        return host.lower(), port, hashlib.sha256(password.encode()).hexdigest()
+
+    @asynccontextmanager
+    async def session(self, host: str, port: int, password: str):
+        """取得並鎖定某個伺服器的連線，區塊結束前其他請求不會插入指令"""
+        key = self._key(host, port, password)
+        entry = self._clients.get(key)
+        if entry is None:
+            entry = self._clients[key] = PooledRconClient(host, port, password)
+            await self._shrink(exclude=key)
+        async with entry.lock:
+            try:
+                yield entry
+            except aiomcrcon.IncorrectPasswordError:
+                # 密碼錯誤的連線不保留在池中
+                self._clients.pop(key, None)
+                await entry.close()
+                raise
+
+    async def send(self, host: str, port: int, password: str, cmd: str):
+        async with self.session(host, port, password) as entry:
+            return await entry.send(cmd)
+
+    async def _shrink(self, exclude: tuple):
+        # 超過上限時關閉最久未使用且沒有在使用中的連線
+        idle = sorted((entry.last_used, key) for key, entry in self._clients.items() if key != exclude and not entry.lock.locked())
+        for _, key in idle[:max(0, len(self._clients) - RCON_POOL_SIZE)]:
+            await self._clients.pop(key).close()
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        for key, entry in list(self._clients.items()):
+            if not entry.lock.locked() and now - entry.last_used >= RCON_IDLE_TIMEOUT:
+                del self._clients[key]
+                await entry.close()
+
+    async def close_all(self):
+        while self._clients:
+            _, entry = self._clients.popitem()
+            await entry.close()
+
+
+rcon_pool = RconPool()
+
+
+async def rcon_pool_eviction_task(stop_event: asyncio.Event):
+    logging.info("Starting RCON pool eviction task...")
+    try:
+        while not stop_event.is_set():
+            try:
+                await rcon_pool.evict_idle()
+            except Exception as e:
+                logging.error(f"Error during RCON pool eviction: {e}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                continue
+    except asyncio.CancelledError:
+        logging.info("RCON pool eviction task cancelled gracefully.")
+    finally:
+        await rcon_pool.close_all()
@@ -0,0 +1,66 @@
+from typing import Optional
+import asyncio, os
+
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SENSOR_SUBSCRIBER_QUEUE_SIZE", 256))  # 每個訂閱者最多暫存的未送出事件
+MAX_SUBSCRIBERS = int(os.getenv("SENSOR_MAX_SUBSCRIBERS", 1000))
+
+
+class Subscription:
+    def __init__(self, sensors: Optional[frozenset]):
+        self.sensors = sensors  # None 表示訂閱全部感測器
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0        # 因佇列已滿而丟棄的事件數
+
+    def offer(self, event: dict):
+        # 不等待慢速的訂閱者：佇列已滿時丟棄最舊的事件
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class SensorBroker:
+    """程序內的感測器資料分發，寫入時依感測器名稱找到訂閱者並放入各自的佇列"""
+
+    def __init__(self):
+        self._by_sensor = {}  # sensor -> set(Subscription)
+        self._all = set()     # 訂閱全部感測器的 Subscription
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def subscribe(self, sensors: Optional[list] = None) -> Subscription:
+        subscription = Subscription(frozenset(sensors) if sensors else None)
+        if subscription.sensors is None:
+            self._all.add(subscription)
+        else:
+            for sensor in subscription.sensors:
+                self._by_sensor.setdefault(sensor, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._count -= 1
+        if subscription.sensors is None:
+            self._all.discard(subscription)
+            return
+        for sensor in subscription.sensors:
+            subs = self._by_sensor.get(sensor)
+            if subs is not None:
+                subs.discard(subscription)
+                if not subs:
+                    del self._by_sensor[sensor]
+
+    def publish(self, sensor: str, readings: list):
+        """需在 event loop 的 thread 中呼叫，readings 為 format_reading 的結果"""
+        subscribers = self._by_sensor.get(sensor, set()) | self._all
+        if not subscribers:
+            return
+        for reading in readings:
+            event = {"sensor": sensor, **reading}
+            for subscription in subscribers:
+                subscription.offer(event)
+
+
+broker = SensorBroker()
@@ -0,0 +1,310 @@
+from datetime import datetime
+import os, sqlite3
+
+SENSOR_DB = os.getenv("SENSOR_DB", "sensors.db")
+BUSY_TIMEOUT = 5000  # 其他連線持有寫入鎖時最多等待的毫秒數
+ROLLUP_BUCKETS = (86400, 3600)  # 預先彙總的 bucket 大小 (秒)，由大到小
+MAX_POINTS = 500  # 彙總查詢最多回傳的點數，未指定 bucket 時依此自動挑選 bucket 大小
+
+ROLLUP_UPSERT = '''
+    INSERT INTO rollups (sensor, bucket, start, count, t_min, t_max, t_sum, h_min, h_max, h_sum)
+    VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (sensor, bucket, start) DO UPDATE SET
+        count = count + 1,
+        t_min = MIN(t_min, excluded.t_min), t_max = MAX(t_max, excluded.t_max), t_sum = t_sum + excluded.t_sum,
+        h_min = MIN(h_min, excluded.h_min), h_max = MAX(h_max, excluded.h_max), h_sum = h_sum + excluded.h_sum
+'''
+
+
+def _connect(check_same_thread: bool = True) -> sqlite3.Connection:
+    # isolation_level=None: 交易由呼叫端以 BEGIN 明確控制
+    conn = sqlite3.connect(SENSOR_DB, timeout=BUSY_TIMEOUT / 1000, isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def create_sensor_db():
+    conn = _connect()
+    try:
+        # WAL 模式下寫入只會附加到 log，讀取不會被寫入阻擋
+        conn.execute("PRAGMA journal_mode=WAL")
+        # (sensor, seq) 為主鍵且不使用 rowid，seq 為各感測器自己的流水號，與舊 db.json 的 id 相同
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS readings (
+            sensor TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            temperature REAL NOT NULL,
+            humidity REAL NOT NULL,
+            PRIMARY KEY (sensor, seq)
+        ) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_sensor_ts ON readings (sensor, ts)")
+        # 各 bucket 的彙總值，寫入時一併更新；長時間範圍的查詢只需讀取少量彙總列
+        has_rollups = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollups'").fetchone()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollups (
+            sensor TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            t_min REAL NOT NULL,
+            t_max REAL NOT NULL,
+            t_sum REAL NOT NULL,
+            h_min REAL NOT NULL,
+            h_max REAL NOT NULL,
+            h_sum REAL NOT NULL,
+            PRIMARY KEY (sensor, bucket, start)
+        ) WITHOUT ROWID''')
+    finally:
+        conn.close()
+    if not has_rollups:
+        # 既有資料庫升級時補上彙總資料
+        rebuild_rollups()
+
+
+def format_reading(row) -> dict:
+    # 與舊 db.json 的項目格式相同
+    return {
+        "id": row[0],
+        "temperature": row[2],
+        "humidity": row[3],
+        "time": datetime.fromtimestamp(row[1]).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def _insert(conn: sqlite3.Connection, sensor: str, readings: list) -> list:
+    # 呼叫前需先以 BEGIN IMMEDIATE 取得寫入鎖，確保流水號不會重複
+    last = conn.execute("SELECT MAX(seq) FROM readings WHERE sensor = ?", (sensor,)).fetchone()[0] or 0
+    rows = [(sensor, last + i, int(ts), temperature, humidity) for i, (ts, temperature, humidity) in enumerate(readings, start=1)]
+    conn.executemany("INSERT INTO readings (sensor, seq, ts, temperature, humidity) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.executemany(ROLLUP_UPSERT, [
+        (sensor, bucket, ts - ts % bucket, temperature, temperature, temperature, humidity, humidity, humidity)
+        for _, _, ts, temperature, humidity in rows
+        for bucket in ROLLUP_BUCKETS
+    ])
+    return rows
+
+
+def append_readings(sensor: str, readings: list) -> list:
+    """在同一個交易中寫入 [(ts, temperature, humidity), ...]，回傳寫入的項目"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = _insert(conn, sensor, readings)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return [format_reading(row[1:]) for row in rows]
+
+
+def append_reading(sensor: str, ts: int, temperature: float, humidity: float) -> dict:
+    return append_readings(sensor, [(ts, temperature, humidity)])[0]
+
+
+def get_reading(sensor: str, seq: int):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT seq, ts, temperature, humidity FROM readings WHERE sensor = ? AND seq = ?", (sensor, seq)).fetchone()
+    finally:
+        conn.close()
+    return format_reading(row) if row else None
+
+
+def get_readings(sensor: str) -> list:
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT seq, ts, temperature, humidity FROM readings WHERE sensor = ? ORDER BY seq", (sensor,)).fetchall()
+    finally:
+        conn.close()
+    return [format_reading(row) for row in rows]
+
+
+def sensor_exists(sensor: str) -> bool:
+    conn = _connect()
+    try:
+        return conn.execute("SELECT 1 FROM readings WHERE sensor = ? LIMIT 1", (sensor,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def find_item(seq: int) -> list:
+    """所有感測器中流水號為 seq 的項目，格式為 [{sensor: 項目}, ...]"""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT sensor, seq, ts, temperature, humidity FROM readings WHERE seq = ? ORDER BY sensor", (seq,)).fetchall()
+    finally:
+        conn.close()
+    return [{row[0]: format_reading(row[1:])} for row in rows]
+
+
+def iter_readings(sensor: str, start: int, end: int, chunk_size: int = 1000):
+    """依時間順序分批產生 [(seq, ts, temperature, humidity), ...]，不會一次載入整個區間"""
+    # StreamingResponse 會在不同的 thread 中取下一批資料，單一 SELECT 在 WAL 模式下讀取的是同一個快照
+    conn = _connect(check_same_thread=False)
+    try:
+        cursor = conn.execute('''
+            SELECT seq, ts, temperature, humidity FROM readings
+            WHERE sensor = ? AND ts >= ? AND ts <= ?
+            ORDER BY ts, seq
+        ''', (sensor, start, end))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def _merge(points: dict, rows):
+    # row: (bucket_start, count, t_min, t_max, t_sum, h_min, h_max, h_sum)
+    for row in rows:
+        point = points.get(row[0])
+        if point is None:
+            points[row[0]] = list(row[1:])
+            continue
+        point[0] += row[1]
+        point[1], point[2], point[3] = min(point[1], row[2]), max(point[2], row[3]), point[3] + row[4]
+        point[4], point[5], point[6] = min(point[4], row[5]), max(point[5], row[6]), point[6] + row[7]
+
+
+def bucket_count(start: int, end: int, bucket: int) -> int:
+    """[start, end] 區間依 bucket 對齊後最多會有幾個點"""
+    return end // bucket - start // bucket + 1
+
+
+def auto_bucket(start: int, end: int) -> int:
+    """挑選讓點數不超過 MAX_POINTS 的最小 bucket，超過一小時則進位為彙總大小的整數倍以讀取彙總表"""
+    bucket = max(60, -(-(end - start + 1) // (MAX_POINTS - 1)))
+    size = ROLLUP_BUCKETS[-1]
+    return bucket if bucket <= size else -(-bucket // size) * size
+
+
+def query_aggregate(sensor: str, start: int, end: int, bucket: int = None) -> dict:
+    """依 bucket 回傳 [start, end] 區間內溫濕度的最小、最大與平均值"""
+    if bucket is None:
+        bucket = auto_bucket(start, end)
+    # bucket 為彙總大小的整數倍時，完整落在區間內的部分讀取彙總表，頭尾不足一個彙總 bucket 的部分讀取原始資料
+    rollup = next((size for size in ROLLUP_BUCKETS if bucket % size == 0), None)
+    raw_ranges = [(start, end)]
+    conn = _connect()
+    try:
+        points = {}
+        if rollup is not None:
+            rollup_start = -(-start // rollup) * rollup
+            rollup_end = (end + 1) // rollup * rollup  # 不含
+            if rollup_start < rollup_end:
+                _merge(points, conn.execute('''
+                    SELECT (start / ?) * ? AS bucket_start, SUM(count), MIN(t_min), MAX(t_max), SUM(t_sum),
+                           MIN(h_min), MAX(h_max), SUM(h_sum)
+                    FROM rollups
+                    WHERE sensor = ? AND bucket = ? AND start >= ? AND start < ?
+                    GROUP BY bucket_start
+                ''', (bucket, bucket, sensor, rollup, rollup_start, rollup_end)))
+                raw_ranges = [(start, rollup_start - 1), (rollup_end, end)]
+        for range_start, range_end in raw_ranges:
+            if range_start > range_end:
+                continue
+            _merge(points, conn.execute('''
+                SELECT (ts / ?) * ? AS bucket_start, COUNT(*), MIN(temperature), MAX(temperature), SUM(temperature),
+                       MIN(humidity), MAX(humidity), SUM(humidity)
+                FROM readings
+                WHERE sensor = ? AND ts >= ? AND ts <= ?
+                GROUP BY bucket_start
+            ''', (bucket, bucket, sensor, range_start, range_end)))
+    finally:
+        conn.close()
+
+    return {
+        "sensor": sensor,
+        "from": start,
+        "to": end,
+        "bucket": bucket,
+        "points": [
+            {
+                "time": bucket_start,
+                "count": point[0],
+                "temperature": {"min": point[1], "max": point[2], "avg": round(point[3] / point[0], 2)},
+                "humidity": {"min": point[4], "max": point[5], "avg": round(point[6] / point[0], 2)},
+            }
+            for bucket_start, point in sorted(points.items())
+        ],
+    }
+
+
+def rebuild_rollups(sensor: str = None):
+    """由原始資料重新計算彙總表，sensor 為 None 時重建全部"""
+    where, values = ("WHERE sensor = ?", (sensor,)) if sensor is not None else ("", ())
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"DELETE FROM rollups {where}", values)
+            for bucket in ROLLUP_BUCKETS:
+                conn.execute(f'''
+                    INSERT INTO rollups (sensor, bucket, start, count, t_min, t_max, t_sum, h_min, h_max, h_sum)
+                    SELECT sensor, ?, (ts / ?) * ?, COUNT(*), MIN(temperature), MAX(temperature), SUM(temperature),
+                           MIN(humidity), MAX(humidity), SUM(humidity)
+                    FROM readings {where}
+                    GROUP BY sensor, (ts / ?) * ?
+                ''', (bucket, bucket, bucket, *values, bucket, bucket))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def get_all_readings() -> dict:
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT sensor, seq, ts, temperature, humidity FROM readings ORDER BY sensor, seq").fetchall()
+    finally:
+        conn.close()
+    data = {}
+    for row in rows:
+        data.setdefault(row[0], []).append(format_reading(row[1:]))
+    return data
+
+
+class ImportConflictError(Exception):
+    def __init__(self, sensor: str, conflicts: list):
+        super().__init__(f"{sensor}: {len(conflicts)} readings conflict with stored ones (ids {', '.join(map(str, conflicts[:10]))}{', ...' if len(conflicts) > 10 else ''})")
+        self.sensor = sensor
+        self.conflicts = conflicts
+
+
+def import_readings(sensor: str, entries: list) -> int:
+    """匯入保留原本 id 的項目 [(seq, ts, temperature, humidity), ...]，回傳新增筆數；匯入後需呼叫 rebuild_rollups"""
+    if not entries:
+        return 0
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            seqs = [entry[0] for entry in entries]
+            existing = {
+                row[0]: row[1:]
+                for row in conn.execute(
+                    "SELECT seq, ts, temperature, humidity FROM readings WHERE sensor = ? AND seq BETWEEN ? AND ?",
+                    (sensor, min(seqs), max(seqs)),
+                )
+            }
+            # 內容相同的 id 視為已匯入；id 已被其他資料使用時 (例如 API 先寫入了新資料) 整批不寫入，避免舊資料被靜默丟棄
+            conflicts = [entry[0] for entry in entries if entry[0] in existing and existing[entry[0]] != tuple(entry[1:])]
+            if conflicts:
+                raise ImportConflictError(sensor, conflicts)
+            new_rows = [(sensor, *entry) for entry in entries if entry[0] not in existing]
+            conn.executemany("INSERT INTO readings (sensor, seq, ts, temperature, humidity) VALUES (?, ?, ?, ?, ?)", new_rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return len(new_rows)
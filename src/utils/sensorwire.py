@@ -0,0 +1,194 @@
+from src.database.mariadb import get_mariadb_connect
+from src.utils.mccache import TTLCache
+from src.utils.sensorstore import append_readings
+from src.utils.sensorbroker import broker
+from collections import OrderedDict
+import asyncio, hashlib, hmac, logging, os, struct, time
+
+# 感測器的二進位上傳格式 (big-endian)，HTTP 與 UDP 共用:
+#
+#     version u8 | name_len u8 | name | ts u32 | counter u32 | count u8 | readings | mac (16 bytes)
+#
+# name 為 api_keys.description (例如 sensor_1)；ts 為送出時間，counter 為裝置端遞增的計數器。
+# 每筆 reading 6 bytes: 距離 ts 的秒數 u16 | 溫度 i16 (0.01 °C) | 濕度 u16 (0.01 %)。
+# mac 為以裝置 api_key 為金鑰、對 mac 之前所有內容計算的 HMAC-SHA256 前 16 bytes。
+
+FRAME_VERSION = 1
+MAC_SIZE = 16
+SENSOR_UDP_PORT = int(os.getenv("SENSOR_UDP_PORT", 0))              # 0 表示不啟動 UDP 接收
+MAX_CLOCK_SKEW = int(os.getenv("SENSOR_MAX_CLOCK_SKEW", 300))       # 封包時間與伺服器時間最多相差幾秒
+DEVICE_CACHE_TTL = float(os.getenv("SENSOR_DEVICE_CACHE_TTL", 300))  # 裝置金鑰的快取秒數
+UDP_RATE = float(os.getenv("SENSOR_UDP_RATE", 5))                  # 每個來源位址每秒可送出的封包數
+LOOKUP_RATE = float(os.getenv("SENSOR_LOOKUP_RATE", 20))           # 每秒最多查詢幾個未快取的裝置名稱
+
+FRAME_HEAD = struct.Struct(">IIB")   # ts, counter, count
+READING = struct.Struct(">HhH")      # 秒數差, 溫度, 濕度
+ACK = struct.Struct(">BI")           # 狀態, counter
+
+device_cache = TTLCache(ttl=DEVICE_CACHE_TTL, max_entries=1024)  # sensor -> 可上傳的 api_key 列表
+_last_seen = {}  # sensor -> 最後接受的 (ts, counter)，用於拒絕重送的封包
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# 查詢資料庫會阻塞 event loop，未快取的名稱 (包含偽造的名稱) 全域限速
+_lookup_bucket = TokenBucket(LOOKUP_RATE, LOOKUP_RATE * 2)
+
+
+class FrameError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def encode_frame(sensor: str, api_key: str, counter: int, readings: list, ts: int = None) -> bytes:
+    """裝置端格式的參考實作，readings 為 [(ts, temperature, humidity), ...]"""
+    ts = int(time.time()) if ts is None else ts
+    name = sensor.encode()
+    body = bytes((FRAME_VERSION, len(name))) + name + FRAME_HEAD.pack(ts, counter, len(readings)) + b"".join(
+        READING.pack(ts - reading_ts, round(temperature * 100), round(humidity * 100))
+        for reading_ts, temperature, humidity in readings
+    )
+    return body + hmac.new(api_key.encode(), body, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def decode_frame(data: bytes) -> tuple:
+    """回傳 (sensor, ts, counter, readings, 簽章內容, mac)，尚未驗證 mac"""
+    if len(data) < 2 + FRAME_HEAD.size + MAC_SIZE or data[0] != FRAME_VERSION:
+        raise FrameError("Malformed frame")
+    name_end = 2 + data[1]
+    head_end = name_end + FRAME_HEAD.size
+    if len(data) < head_end + MAC_SIZE:
+        raise FrameError("Malformed frame")
+    ts, counter, count = FRAME_HEAD.unpack_from(data, name_end)
+    if len(data) != head_end + count * READING.size + MAC_SIZE:
+        raise FrameError("Malformed frame")
+    try:
+        sensor = data[2:name_end].decode()
+    except UnicodeDecodeError:
+        raise FrameError("Malformed frame")
+    readings = [
+        (ts - offset, temperature / 100, humidity / 100)
+        for offset, temperature, humidity in READING.iter_unpack(data[head_end:-MAC_SIZE])
+    ]
+    return sensor, ts, counter, readings, data[:-MAC_SIZE], data[-MAC_SIZE:]
+
+
+async def _fetch_device_keys(sensor: str) -> list:
+    conn, cursor = await get_mariadb_connect()
+    try:
+        cursor.execute("SELECT api_key, permissions FROM api_keys WHERE description = %s", (sensor,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    keys = []
+    for row in rows:
+        permissions = (row["permissions"] or "").split(",")
+        if "global" in permissions or "post_temp_hum" in permissions:
+            keys.append(row["api_key"])
+    return keys
+
+
+async def device_keys(sensor: str) -> list:
+    hit = device_cache.get(sensor)
+    if hit is not None:
+        return hit[0]
+    if not _lookup_bucket.allow():
+        raise FrameError("Too many unknown devices", 429)
+    keys, _, _ = await device_cache.get_or_fetch(sensor, lambda: _fetch_device_keys(sensor))
+    return keys
+
+
+async def verify_frame(data: bytes) -> tuple:
+    """驗證封包的格式、HMAC、時間與計數器，回傳 (sensor, ts, counter, readings, 是否為重送的封包)"""
+    sensor, ts, counter, readings, signed, mac = decode_frame(data)
+    keys = await device_keys(sensor)
+    if not any(hmac.compare_digest(hmac.new(key.encode(), signed, hashlib.sha256).digest()[:MAC_SIZE], mac) for key in keys):
+        raise FrameError("Invalid signature", 401)
+    if abs(ts - time.time()) > MAX_CLOCK_SKEW:
+        raise FrameError("Frame time is outside the allowed window", 401)
+    # 時間窗外的封包已被拒絕，窗內則要求 (ts, counter) 嚴格遞增
+    last = _last_seen.get(sensor, (0, -1))
+    if (ts, counter) == last:
+        # 與最後接受的封包相同：裝置沒收到回應而重送，已通過 HMAC 驗證，回覆成功但不重複寫入
+        return sensor, ts, counter, readings, True
+    if (ts, counter) < last:
+        raise FrameError("Replayed frame", 409)
+    return sensor, ts, counter, readings, False
+
+
+async def ingest_frame(data: bytes) -> tuple:
+    """驗證並寫入封包，回傳 (sensor, counter, 寫入的項目)；重送的封包不會再寫入"""
+    sensor, ts, counter, readings, duplicate = await verify_frame(data)
+    if duplicate:
+        return sensor, counter, []
+    stored = append_readings(sensor, sorted(readings, key=lambda reading: reading[0])) if readings else []
+    # 寫入成功後才記錄為已接受，寫入失敗時裝置重送的封包仍會被寫入
+    _last_seen[sensor] = (ts, counter)
+    if stored:
+        broker.publish(sensor, stored)
+    return sensor, counter, stored
+
+
+class SensorUDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, max_sources: int = 4096):
+        self._pending = set()           # 處理中的 task 的 reference
+        self._sources = OrderedDict()  # 來源位址 -> TokenBucket
+        self.max_sources = max_sources
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _allow(self, host: str) -> bool:
+        bucket = self._sources.get(host)
+        if bucket is None:
+            bucket = self._sources[host] = TokenBucket(UDP_RATE, UDP_RATE * 4)
+            if len(self._sources) > self.max_sources:
+                self._sources.popitem(last=False)
+        self._sources.move_to_end(host)
+        return bucket.allow()
+
+    def datagram_received(self, data, addr):
+        # UDP 沒有 HTTP 的 RateLimiter，依來源位址限速
+        if not self._allow(addr[0]):
+            return
+        task = asyncio.create_task(self._handle(data, addr))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _handle(self, data: bytes, addr):
+        try:
+            _, counter, _ = await ingest_frame(data)
+        except FrameError as e:
+            # 只回應驗證通過的封包，避免被當作反射放大攻擊的跳板
+            logging.debug(f"Rejected sensor frame from {addr[0]}: {e.message}")
+            return
+        except Exception as e:
+            logging.error(f"Error while ingesting sensor frame from {addr[0]}: {e}")
+            return
+        self.transport.sendto(ACK.pack(0, counter), addr)
+
+
+async def start_sensor_udp_listener():
+    if not SENSOR_UDP_PORT:
+        return None
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(SensorUDPProtocol, local_addr=("0.0.0.0", SENSOR_UDP_PORT))
+    logging.info(f"Sensor UDP listener started on port {SENSOR_UDP_PORT}")
+    return transport